@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Coverage plugin benchmarks
+
+Times the plugin against a stand-in coverage worker (``fakeworker.py``) with
+configurable results size, output size and delay, so that the numbers only
+depend on the plugin:
+
+- ``latency``: from Analyze to the results being displayed
+- ``store``: saving and loading the results history, per ``max_entries``
+- ``output``: throughput of the output of an analysis (``read_output``)
+- ``report``: text report of large results (``format_report``)
+- ``render``: display of large results (``ResultsWindow``)
+
+Usage::
+
+    python bench_coverage.py [--save FILE] [--compare FILE] [benchmark ...]
+
+``--compare`` exits with status 1 if a benchmark got slower than the saved
+numbers by more than ``--tolerance``. The ``latency``, ``output`` and
+``render`` benchmarks need Spyder; the plugin must be installed (see the
+README).
+"""
+
+# pylint: disable=C0103
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path as osp
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+FAKE_WORKER = osp.join(osp.dirname(osp.abspath(__file__)), 'fakeworker.py')
+sys.path.insert(0, osp.dirname(FAKE_WORKER))
+from fakeworker import fake_results
+
+from spyderplugins.widgets.coveragestore import ResultsStore
+from spyderplugins.widgets.coveragecore import VERSION, format_report
+
+
+def repeat(func, count):
+    """Return the durations (seconds) of ``count`` calls of ``func``"""
+    durations = []
+    for _index in range(count):
+        start = time.time()
+        func()
+        durations.append(time.time() - start)
+    return durations
+
+
+def stats(durations):
+    """Return the median, minimum and maximum of ``durations``"""
+    ordered = sorted(durations)
+    return {'median': ordered[len(ordered) // 2], 'min': ordered[0],
+            'max': ordered[-1]}
+
+
+#==============================================================================
+# Qt-free benchmarks
+#==============================================================================
+def bench_store(options, tempdir):
+    """Save and load the results history, for several history depths"""
+    numbers = {}
+    data = dict(fake_results(osp.join(tempdir, 'script.py'),
+                             options.entry_files, options.lines),
+                date=time.localtime(), settings={}, timings=[])
+    for max_entries in (10, 100, 1000):
+        path = osp.join(tempdir, 'store%d.results' % max_entries)
+        store = ResultsStore(path, VERSION, max_entries)
+        names = ['/project/script%d.py' % index
+                 for index in range(max_entries)]
+        saves = []
+        for name in names:
+            start = time.time()
+            store.set(name, data)
+            saves.append(time.time() - start)
+        store.close()
+
+        def load():
+            """Open the history, list it and load an entry"""
+            store = ResultsStore(path, VERSION, max_entries)
+            store.filenames()
+            store.get(names[-1])
+            store.close()
+        numbers['store.save[%d]' % max_entries] = stats(saves)
+        numbers['store.load[%d]' % max_entries] = \
+            stats(repeat(load, options.repeat))
+    return numbers
+
+
+def bench_report(options, tempdir):
+    """Format the text report of large results"""
+    results = fake_results(osp.join(tempdir, 'script.py'), options.files,
+                           options.lines)
+    return {'report': stats(repeat(lambda: format_report(results, tempdir),
+                                   options.repeat))}
+
+
+#==============================================================================
+# Qt benchmarks
+#==============================================================================
+def patch_worker():
+    """
+    Make the plugin run the stand-in worker, and return the application and
+    the plugin module
+    """
+    from spyderlib.utils.qthelpers import qapplication
+    from spyderplugins.widgets import coveragegui
+    app = qapplication()
+    coveragegui.WORKER_PATH = FAKE_WORKER
+    coveragegui._coverage_path = FAKE_WORKER
+    coveragegui._dependency_registered = True
+    return app, coveragegui
+
+
+def wait_for(obj, signal, timeout=60):
+    """Run the event loop until ``obj`` emits ``signal``"""
+    from spyderlib.qt.QtCore import QEventLoop, QTimer, SIGNAL
+    loop = QEventLoop()
+    obj.connect(obj, SIGNAL(signal), loop.quit)
+    QTimer.singleShot(int(timeout * 1000), loop.quit)
+    loop.exec_()
+    obj.disconnect(obj, SIGNAL(signal), loop.quit)
+
+
+def bench_latency(options, tempdir):
+    """Time Analyze to displayed results"""
+    _app, coveragegui = patch_worker()
+    # Nothing is written to the configuration directory of Spyder (the data
+    # of the runs is kept next to DATAPATH)
+    coveragegui.CoverageWidget.DATAPATH = osp.join(tempdir, 'latency.results')
+    coveragegui.CoverageWidget.HTMLPATH = osp.join(tempdir, 'latency.html')
+    script = osp.join(tempdir, 'script.py')
+    with open(script, 'w') as fobj:
+        fobj.write('print("benchmark")\n')
+    widget = coveragegui.CoverageWidget(None)
+    widget.use_cache = False
+    widget.show()
+
+    def analyze():
+        """Analyze and wait for the results to be shown"""
+        widget.analyze(script)
+        wait_for(widget, "results_shown(PyQt_PyObject)")
+    durations = repeat(analyze, options.repeat)
+    widget.kill_if_running(all_jobs=True)
+    widget.close()
+    return {'latency': stats(durations)}
+
+
+def bench_output(options, tempdir):
+    """Throughput of the output of an analysis, in MB/s"""
+    _app, coveragegui = patch_worker()
+    script = osp.join(tempdir, 'script.py')
+    size = int(options.output_size * 2 ** 20)
+    os.environ['FAKE_COVERAGE_OUTPUT'] = str(size)
+
+    def run():
+        """Run an analysis and wait for its end"""
+        job = coveragegui.AnalysisJob(None, script)
+        job.start_process()
+        if job.is_active():
+            wait_for(job, "finished()")
+    try:
+        durations = repeat(run, options.repeat)
+    finally:
+        del os.environ['FAKE_COVERAGE_OUTPUT']
+    numbers = stats(durations)
+    numbers['throughput'] = options.output_size / numbers['median']
+    return {'output': numbers}
+
+
+def bench_render(options, tempdir):
+    """Display large results"""
+    app, coveragegui = patch_worker()
+    script = osp.join(tempdir, 'script.py')
+    files = fake_results(script, options.files, options.lines)['files']
+    window = coveragegui.ResultsWindow(None)
+    window.show()
+
+    def render():
+        """Show the results, all expanded"""
+        window.set_results(script, files)
+        window.tree.expandAll()
+        app.processEvents()
+    durations = repeat(render, options.repeat)
+    window.close()
+    return {'render': stats(durations)}
+
+
+BENCHMARKS = {'latency': bench_latency, 'store': bench_store,
+              'output': bench_output, 'report': bench_report,
+              'render': bench_render}
+
+
+def compare(numbers, baseline, tolerance):
+    """
+    Print the ratios of ``numbers`` to the ``baseline`` ones, and return the
+    names of the benchmarks slower by more than ``tolerance``
+    """
+    slower = []
+    for name in sorted(numbers):
+        if name not in baseline:
+            continue
+        ratio = numbers[name]['median'] / max(baseline[name]['median'], 1e-9)
+        print('%-24s x%.2f' % (name, ratio))
+        if ratio > tolerance:
+            slower.append(name)
+    return slower
+
+
+def main(argv=None):
+    """Benchmarks entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of runs per benchmark")
+    parser.add_argument('--files', type=int, default=2000,
+                        help="number of files in the results")
+    parser.add_argument('--entry-files', type=int, default=50,
+                        help="number of files per history entry (store)")
+    parser.add_argument('--lines', type=int, default=200,
+                        help="number of statements per file")
+    parser.add_argument('--output-size', type=float, default=16,
+                        help="output of an analysis, in MB")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="duration of an analysis in the worker (s)")
+    parser.add_argument('--save', help="save the numbers to this JSON file")
+    parser.add_argument('--compare',
+                        help="compare with the numbers of this JSON file")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument('benchmarks', nargs='*', choices=sorted(BENCHMARKS),
+                        metavar='benchmark',
+                        help="benchmarks to run (default: all of them)")
+    options = parser.parse_args(argv)
+    os.environ['FAKE_COVERAGE_DELAY'] = str(options.delay)
+    os.environ['FAKE_COVERAGE_FILES'] = str(options.files)
+    os.environ['FAKE_COVERAGE_LINES'] = str(options.lines)
+
+    numbers = {}
+    tempdir = tempfile.mkdtemp(prefix='coverage-bench-')
+    try:
+        for name in options.benchmarks or sorted(BENCHMARKS):
+            results = BENCHMARKS[name](options, tempdir)
+            for key in sorted(results):
+                print('%-24s %8.1f ms  (min %.1f, max %.1f)'
+                      % (key, results[key]['median'] * 1000,
+                         results[key]['min'] * 1000,
+                         results[key]['max'] * 1000))
+            numbers.update(results)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    if 'output' in numbers:
+        print('%-24s %8.1f MB/s' % ('output.throughput',
+                                    numbers['output']['throughput']))
+    if options.save:
+        with open(options.save, 'w') as fobj:
+            json.dump(numbers, fobj, indent=1, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as fobj:
+            slower = compare(numbers, json.load(fobj), options.tolerance)
+        if slower:
+            print('Slower than %s: %s' % (options.compare, ', '.join(slower)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Stand-in coverage worker
+
+Accepts the command line of ``coverageworker.py`` but measures nothing: it
+writes synthetic results after a delay, and some output, so that the plugin
+can be benchmarked without depending on the speed of coverage or of the code
+under test. Configured through environment variables (inherited from the
+benchmark by the processes the plugin starts):
+
+- ``FAKE_COVERAGE_DELAY``: seconds to sleep before writing the results (0)
+- ``FAKE_COVERAGE_OUTPUT``: bytes written to the standard output (0)
+- ``FAKE_COVERAGE_FILES``: number of measured files in the results (10)
+- ``FAKE_COVERAGE_LINES``: number of statements per file (200)
+
+This module must only depend on the standard library.
+"""
+
+# pylint: disable=C0103
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path as osp
+import time
+import json
+import argparse
+
+STARTED = time.time()
+
+
+def env_number(name, default, kind=int):
+    """Return the number set in the environment variable ``name``"""
+    try:
+        return kind(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def fake_file_data(lines):
+    """
+    Return the results of a file of ``lines`` statements, one line out of
+    three being missing
+    """
+    statements = list(range(1, lines + 1))
+    missing = statements[::3]
+    return {'statements': statements,
+            'executed': [line for line in statements if line % 3 != 1],
+            'missing': missing, 'excluded': []}
+
+
+def fake_results(filename, files, lines):
+    """Return the results of ``files`` measured files, as the worker does"""
+    root = osp.join(osp.dirname(osp.abspath(filename)), 'fakepkg')
+    results = {'version': 1, 'branch': False, 'filename': filename,
+               'status': 0, 'modules': [], 'files': {}, 'sources': {}}
+    for index in range(files):
+        # Ten modules per sub-package, so that the results are a tree
+        path = osp.join(root, 'sub%d' % (index // 10), 'mod%d.py' % index)
+        results['files'][path] = fake_file_data(lines)
+        results['sources'][path] = None
+    return results
+
+
+def write_output(size):
+    """Write ``size`` bytes of output, in lines, like a chatty script"""
+    line = 'x' * 79 + '\n'
+    count, rest = divmod(size, len(line))
+    for _index in range(count):
+        sys.stdout.write(line)
+    sys.stdout.write(line[:rest])
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    """Stand-in worker entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--combine', action='store_true')
+    parser.add_argument('--tests', action='store_true')
+    parser.add_argument('--data-file')
+    parser.add_argument('filename', nargs='?')
+    options, _args = parser.parse_known_args(argv)
+    if options.tests:
+        # A shard: combining writes the results
+        return 0
+    start = time.time()
+    time.sleep(env_number('FAKE_COVERAGE_DELAY', 0, float))
+    write_output(env_number('FAKE_COVERAGE_OUTPUT', 0))
+    results = fake_results(options.filename or '.',
+                           env_number('FAKE_COVERAGE_FILES', 10),
+                           env_number('FAKE_COVERAGE_LINES', 200))
+    results['timings'] = {'started': STARTED, 'run': time.time() - start}
+    if options.output:
+        with open(options.output, 'w') as fobj:
+            json.dump(results, fobj)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,874 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Coverage core
+
+The analysis pipeline without Qt: measurement settings, runs of the coverage
+worker, storage of the results and reports. The coverage widget uses it, and
+it is a batch command line tool writing into the same results store, e.g. to
+compute the coverage history on a build machine::
+
+    python -m spyderplugins.widgets.coveragecore --store coverage.results
+                                                 script.py package ...
+
+One JSON line is written to the standard output per analyzed file, as soon as
+its analysis is finished.
+"""
+
+# pylint: disable=C0103
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path as osp
+import time
+import json
+import shutil
+import hashlib
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from spyderplugins.widgets.coverageworker import (has_changed,
+                                                  find_test_modules,
+                                                  shard_modules,
+                                                  settings_args,
+                                                  add_measure_options,
+                                                  settings_from_args,
+                                                  heartbeat_path, cancel_path)
+from spyderplugins.widgets.coveragestore import ResultsStore
+from spyderplugins.widgets.coverageimpact import (build_index, select_tests,
+                                                  merge)
+
+# Version of the stored results
+VERSION = '1.4.0'
+
+WORKER_PATH = osp.join(osp.dirname(osp.abspath(__file__)),
+                       'coverageworker.py')
+
+
+def default_store_path():
+    """Return the path of Spyder's results store, None outside of Spyder"""
+    try:
+        from spyderlib.baseconfig import get_conf_path
+    except ImportError:
+        return None
+    return get_conf_path('coverage.results')
+
+
+def sources_changed(sources):
+    """
+    Return True if any of the ``sources`` (a dict mapping filenames to their
+    fingerprint, as recorded by the worker) changed
+    """
+    return any(fprint is None or has_changed(filename, fprint)
+               for filename, fprint in sources.items())
+
+
+def is_up_to_date(data, settings, filename):
+    """
+    Return True if the stored ``data`` of ``filename`` were measured with
+    these ``settings`` and none of their source files changed since, nor the
+    test modules found in the package ``filename`` (see ``store_results``)
+    """
+    if data is None or data.get('settings', {}) != settings \
+       or sources_changed(data['sources']):
+        return False
+    return 'test_modules' not in data \
+        or find_test_modules(osp.abspath(filename)) == data['test_modules']
+
+
+# Files and directories marking the root directory of a project
+PROJECT_MARKERS = ('setup.py', 'setup.cfg', 'pyproject.toml', '.git', '.hg',
+                   '.svn', '.spyderproject')
+
+
+def find_project_root(filename):
+    """
+    Return the root directory of the project of ``filename`` (a file or a
+    package directory): the nearest directory above it holding a project
+    file (``setup.py``, ``pyproject.toml``, ``.git``...), or else the
+    directory holding its top-level package
+    """
+    path = osp.abspath(filename)
+    if not osp.isdir(path):
+        path = osp.dirname(path)
+    current = path
+    while True:
+        if any(osp.exists(osp.join(current, marker))
+               for marker in PROJECT_MARKERS):
+            return current
+        parent = osp.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    while osp.isfile(osp.join(path, '__init__.py')):
+        path = osp.dirname(path)
+    return path
+
+
+def get_scope(store, root):
+    """
+    Return the measurement scope of the project ``root``: its stored scope,
+    or by default the whole project
+    """
+    return store.get_scope(root) or {'source': [], 'omit': []}
+
+
+def analysis_settings(settings, root=None, scope=None):
+    """
+    Return the measurement settings of an analysis: the ``settings`` of the
+    plugin, restricted to the ``scope`` of the project ``root`` (by default,
+    the files under the root) if no source is set. The settings are left
+    as is if ``root`` is None.
+    """
+    settings = dict(settings)
+    if root is not None and not settings.get('source'):
+        scope = scope or {'source': [], 'omit': []}
+        if scope['source']:
+            settings['source'] = scope['source']
+        elif not settings.get('include'):
+            # Unlike a source, this does not report the files of the project
+            # that were not run
+            settings['include'] = [osp.join(root, '*')]
+        settings['omit'] = list(settings.get('omit', [])) + scope['omit']
+    return settings
+
+
+def test_selection(store, package, modules, settings):
+    """
+    Return the test impact selection of a run of the test ``modules`` of
+    ``package`` (see ``coverageimpact.select_tests``), None if all of them
+    have to run. The test index only applies to runs with the same settings.
+    """
+    data = store.get(osp.abspath(package))
+    if data is None or data.get('settings', {}) != settings:
+        return None
+    return select_tests(store.get_test_index(osp.abspath(package)), modules)
+
+
+def impact_available(settings):
+    """
+    Return True if the test impact analysis can run with the measurement
+    ``settings``: the lines run by each test are not recorded with branch
+    coverage (see ``coverageimpact.build_index``), the whole test suite
+    running every time
+    """
+    return not settings.get('branch')
+
+
+def update_test_index(store, impact, results):
+    """
+    Update the test index of the package whose test suite was run and
+    return the results of the whole suite: the ``results`` of a test
+    impact selection only cover the selected tests.
+
+    ``impact`` is the ``(package, test modules, selection)`` of the run.
+    """
+    package, modules, selection = impact
+    if selection is None:
+        index = build_index(results, modules)
+    else:
+        index = store.get_test_index(package)
+        results, index = merge(index, selection, results, modules)
+    store.set_test_index(package, index)
+    return results
+
+
+def store_results(store, filename, results, settings, timings,
+                  test_modules=None):
+    """
+    Store the ``results`` of an analysis of ``filename``, with the
+    ``test_modules`` found in it for a package: adding or removing one
+    outdates the results (see ``is_up_to_date``)
+    """
+    data = dict(date=time.localtime(), files=results['files'],
+                sources=results['sources'], settings=settings,
+                timings=timings)
+    if test_modules is not None:
+        data['test_modules'] = sorted(osp.abspath(module)
+                                      for module in test_modules)
+    store.set(osp.abspath(filename), data)
+
+
+def discard_results(path):
+    """Remove the results file ``path`` of a cancelled analysis"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def job_log_path(path):
+    """
+    Return the path of the output file of the warm worker job writing the
+    results file ``path``
+    """
+    return path + '.log'
+
+
+def read_job_log(path):
+    """
+    Read and delete the output of the warm worker job writing the results
+    file ``path`` (as bytes)
+    """
+    log = job_log_path(path)
+    try:
+        with open(log, 'rb') as fobj:
+            return fobj.read()
+    except (IOError, OSError):
+        return b''
+    finally:
+        discard_results(log)
+
+
+# Seconds a console analysis may take to start (the console may be running
+# other code) and may leave its heartbeat file untouched before it is
+# considered dead
+CONSOLE_START_TIMEOUT = 60
+CONSOLE_TIMEOUT = 30
+
+
+def console_alive(path, started):
+    """
+    Return True if the console analysis writing the results file ``path``,
+    run at the ``started`` time, may still write it: it started in time and
+    touches its heartbeat file (see ``coverageworker.measure_in_console``)
+    """
+    try:
+        mtime = os.stat(heartbeat_path(path)).st_mtime
+    except OSError:
+        return time.time() - started < CONSOLE_START_TIMEOUT
+    return time.time() - mtime < CONSOLE_TIMEOUT
+
+
+def cancel_console(path):
+    """
+    Cancel the console analysis writing the results file ``path``: it
+    discards its results and data when it ends, or is not run at all.
+    Results it already wrote are removed.
+    """
+    if osp.exists(path):
+        discard_results(path)
+        return
+    try:
+        open(cancel_path(path), 'w').close()
+    except (IOError, OSError):
+        pass
+
+
+def read_results(path):
+    """
+    Read and delete the JSON results file written by the coverage worker.
+
+    Returns None if the worker did not write any results.
+    """
+    try:
+        with open(path) as fobj:
+            return json.load(fobj)
+    except (IOError, OSError, ValueError):
+        return None
+    finally:
+        discard_results(path)
+
+
+def file_key(filename):
+    """Return the key of the analyzed ``filename`` in file names"""
+    return hashlib.sha1(osp.abspath(filename).encode('utf-8')).hexdigest()[:16]
+
+
+def html_directory(root, filename):
+    """Return the HTML report directory of ``filename`` under ``root``"""
+    return osp.join(root, file_key(filename))
+
+
+def data_cache_path(store_path):
+    """Return the data cache directory of the results store ``store_path``"""
+    return osp.join(osp.dirname(osp.abspath(store_path)), 'coverage.data')
+
+
+class DataCache(object):
+    """
+    Coverage data files of the analyses, one per run, so that concurrent runs
+    never share a data file and that the data can be reused (e.g. for an HTML
+    report) without measuring again.
+
+    The files older than ``max_age`` seconds are evicted, then the oldest
+    ones until the cache holds at most ``max_size`` bytes: the latest file
+    of each analyzed file is only evicted by age.
+    """
+    SUFFIX = '.data'
+
+    def __init__(self, directory, max_size=200 * 2 ** 20,
+                 max_age=7 * 86400):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def new_file(self, filename):
+        """Return the path of a new data file for a run of ``filename``"""
+        if not osp.isdir(self.directory):
+            os.makedirs(self.directory)
+        fd, path = tempfile.mkstemp(prefix=file_key(filename) + '.',
+                                    suffix=self.SUFFIX, dir=self.directory)
+        os.close(fd)
+        return path
+
+    def files(self):
+        """Return the ``(mtime, size, key, path)`` of the data files"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = osp.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name.split('.')[0],
+                          path))
+        return sorted(files)
+
+    def latest(self, filename):
+        """
+        Return the data file of the latest run of ``filename``, None if there
+        is none (runs that did not write their data are ignored)
+        """
+        key = file_key(filename)
+        paths = [path for _mtime, size, fkey, path in self.files()
+                 if fkey == key and size]
+        return paths[-1] if paths else None
+
+    def evict(self):
+        """Remove the data files that are too old, or too many"""
+        files = self.files()
+        # The empty files of the runs that did not write their data are not
+        # the latest data of their analyzed file
+        latest = dict((key, path) for _mtime, size, key, path in files
+                      if size)
+        now = time.time()
+        kept = []
+        for mtime, size, key, path in files:
+            if now - mtime > self.max_age:
+                discard_results(path)
+            else:
+                kept.append((mtime, size, key, path))
+        total = sum(size for _mtime, size, _key, _path in kept)
+        for _mtime, size, key, path in kept:
+            if total <= self.max_size:
+                break
+            if latest.get(key) != path:
+                discard_results(path)
+                total -= size
+
+
+def results_path():
+    """Return the path of a new results file"""
+    fd, path = tempfile.mkstemp(prefix='coverage-', suffix='.json')
+    os.close(fd)
+    return path
+
+
+def worker_timings(worker, started, end, shards_done=None):
+    """
+    Return the durations of the phases of an analysis as ``(phase, seconds)``
+    given the ``worker`` timings of its results, the start and end times of
+    the analysis and the time its shards were done (for a test suite)
+    """
+    timings = []
+    mark = started
+    if shards_done is not None:
+        timings.append(('tests', shards_done - mark))
+        mark = shards_done
+    if 'started' in worker:
+        # Interpreter startup and imports of the (last) worker
+        timings.append(('startup', max(0, worker['started'] - mark)))
+        mark = worker['started']
+        for phase in ('run', 'save', 'combine', 'collect'):
+            if phase in worker:
+                timings.append((phase, worker[phase]))
+                mark += worker[phase]
+    # Writing the results, exit of the worker
+    timings.append(('exit', max(0, end - mark)))
+    return timings
+
+
+def start_worker(p_args, cwd, python=None):
+    """Start a worker process with arguments ``p_args``"""
+    return subprocess.Popen([python or sys.executable, WORKER_PATH] + p_args,
+                            cwd=cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+
+
+def measure_args(filename, output, settings=None, save_data=None):
+    """
+    Return the worker arguments measuring the file ``filename``, writing the
+    results to ``output`` and saving the data to ``save_data`` if given
+    """
+    args = settings_args(settings) + ['--output', output]
+    if save_data is not None:
+        args += ['--save-data', save_data]
+    return args + [filename]
+
+
+def test_names(modules, selection=None):
+    """
+    Return the test names run for the test ``modules`` of a package, only
+    the selected ones if a test impact ``selection`` is given, and the files
+    to analyze even if none of the tests runs them
+    """
+    if selection is None:
+        return modules, []
+    return selection.names, selection.changed_files()
+
+
+def shard_args(names, count, data_file, settings=None):
+    """
+    Return the worker arguments of each shard of a run of the test ``names``
+    split into ``count`` shards, saving their data to ``data_file`` with a
+    parallel-mode suffix
+    """
+    return [settings_args(settings) + ['--tests', '--data-file', data_file]
+            + shard for shard in shard_modules(names, count)]
+
+
+def combine_args(package, data_file, output, extra_files=(), settings=None,
+                 save_data=None):
+    """
+    Return the worker arguments combining the data of the shards of a run of
+    the tests of ``package`` (see ``shard_args``), writing the results to
+    ``output``. The ``extra_files`` are analyzed even if none of the tests
+    runs them. The data is also saved to ``save_data`` if given.
+    """
+    args = settings_args(settings) + ['--combine', '--data-file', data_file,
+                                      '--output', output]
+    for name in extra_files:
+        args += ['--include-file', name]
+    if save_data is not None:
+        args += ['--save-data', save_data]
+    return args + [package]
+
+
+def run_analysis(filename, settings=None, modules=None, count=1,
+                 selection=None, python=None, save_data=None):
+    """
+    Run an analysis of ``filename`` in worker processes, without Qt: the
+    test ``modules`` of a package are run in ``count`` parallel processes
+    (only the selected tests if a test impact ``selection`` is given). The
+    data is also saved to ``save_data`` if given.
+
+    Returns the results (None if the analysis failed), the timings and the
+    output of the workers.
+    """
+    started = time.time()
+    output = results_path()
+    shards_done = None
+    texts = []
+    if modules:
+        tempdir = tempfile.mkdtemp(prefix='coverage-')
+        data_file = osp.join(tempdir, '.coverage')
+        names, extra_files = test_names(modules, selection)
+        processes = [start_worker(p_args, filename, python) for p_args
+                     in shard_args(names, count, data_file, settings)]
+        for process in processes:
+            texts.append(process.communicate()[0])
+        shards_done = time.time()
+        process = start_worker(combine_args(filename, data_file, output,
+                                            extra_files, settings,
+                                            save_data),
+                               filename, python)
+        texts.append(process.communicate()[0])
+        shutil.rmtree(tempdir, ignore_errors=True)
+    else:
+        process = start_worker(measure_args(filename, output, settings,
+                                            save_data),
+                               osp.dirname(filename), python)
+        texts.append(process.communicate()[0])
+    end = time.time()
+    results = read_results(output)
+    worker = {} if results is None else results.pop('timings', {})
+    timings = worker_timings(worker, started, end, shards_done)
+    timings.append(('read', time.time() - end))
+    text = b''.join(texts).decode(sys.getfilesystemencoding() or 'utf-8',
+                                  'replace')
+    return results, timings, text
+
+
+def line_ranges(statements, lines):
+    """
+    Return ``lines`` as a list of ``(start, end)`` ranges.
+
+    Like ``coverage report -m``, a range spans every statement between its
+    ends, so non-statement lines (comments, blanks) do not split it.
+    """
+    lines = set(lines)
+    pairs = []
+    start = end = None
+    for line in sorted(statements):
+        if line in lines:
+            if start is None:
+                start = line
+            end = line
+        elif start is not None:
+            pairs.append((start, end))
+            start = None
+    if start is not None:
+        pairs.append((start, end))
+    return pairs
+
+
+def format_range(start, end):
+    """Format a range of lines, e.g. ``"5-11"``"""
+    return str(start) if start == end else '%d-%d' % (start, end)
+
+
+def format_lines(statements, lines):
+    """
+    Format ``lines`` as a compact list of ranges, e.g. ``"1-2, 5-11, 13"``.
+    """
+    return ', '.join(format_range(start, end)
+                     for start, end in line_ranges(statements, lines))
+
+
+def partial_arcs(arcs, missing):
+    """
+    Return the missing branch ``arcs`` that are not already covered by the
+    ``missing`` lines
+    """
+    missing = set(missing)
+    return [(start, end) for start, end in sorted(arcs)
+            if start not in missing and end not in missing]
+
+
+def format_arc(start, end):
+    """Format a branch arc, e.g. ``"4->6"`` or ``"9->exit"``"""
+    return '%d->%s' % (start, end if end > 0 else 'exit')
+
+
+def format_arcs(arcs, missing):
+    """
+    Format the missing branch ``arcs`` that are not already covered by the
+    ``missing`` lines, e.g. ``"4->6, 9->exit"``
+    """
+    return ', '.join(format_arc(start, end)
+                     for start, end in partial_arcs(arcs, missing))
+
+
+def percent_covered(executed, total):
+    """
+    Return the covered percentage rounded like coverage does: never 0 if
+    something ran and never 100 if something was missed.
+    """
+    if not total:
+        return 100
+    percent = 100.0 * executed / total
+    if 0 < percent < 1:
+        return 1
+    if 99 < percent < 100:
+        return 99
+    return int(round(percent))
+
+
+def file_counts(fdata):
+    """
+    Return the statement, missing, branch and missing branch counts of the
+    worker data of a file
+    """
+    return [len(fdata['statements']), len(fdata['missing']),
+            fdata.get('branches', 0), fdata.get('missing_branches', 0)]
+
+
+def file_summary(fdata):
+    """Return the counts and the covered percentage of a file, as a dict"""
+    counts = file_counts(fdata)
+    stmts, miss, branches, miss_branches = counts
+    return {'statements': stmts, 'missing': miss, 'branches': branches,
+            'missing_branches': miss_branches,
+            'percent': counts_percent(counts)}
+
+
+def counts_percent(counts):
+    """
+    Return the covered percentage of statement, missing, branch and missing
+    branch ``counts``
+    """
+    statements, missing, branches, missing_branches = counts
+    return percent_covered(statements - missing + branches - missing_branches,
+                           statements + branches)
+
+
+def parent_directories(path):
+    """Generate the directories holding ``path``, nearest first"""
+    while True:
+        parent = osp.dirname(path)
+        if parent == path:
+            return
+        yield parent
+        path = parent
+
+
+class Rollups(object):
+    """
+    Statement, missing, branch and missing branch totals of the results of
+    every directory, and of all files.
+
+    Updating the results only adds the difference of the counts of the files
+    whose counts changed to their directories: the totals are not summed
+    again over all the files.
+    """
+    def __init__(self):
+        self.counts = {}        # file: counts
+        self.totals = {}        # directory: counts
+        self.total = [0, 0, 0, 0]
+        # Number of files directly in each directory
+        self.direct = {}
+
+    def add(self, path, counts, sign=1):
+        """Add (or subtract) the ``counts`` of ``path`` to the totals"""
+        self.total = [total + sign * count
+                      for total, count in zip(self.total, counts)]
+        for directory in parent_directories(path):
+            totals = self.totals.get(directory, [0, 0, 0, 0])
+            totals = [total + sign * count
+                      for total, count in zip(totals, counts)]
+            if any(totals):
+                self.totals[directory] = totals
+            else:
+                # Nothing left (or nothing to count) under the directory
+                self.totals.pop(directory, None)
+        directory = osp.dirname(path)
+        self.direct[directory] = self.direct.get(directory, 0) + sign
+        if not self.direct[directory]:
+            del self.direct[directory]
+
+    def update(self, files):
+        """
+        Update the totals with the worker data of the measured ``files``,
+        which replace the previous ones
+        """
+        for path in set(self.counts) - set(files):
+            self.add(path, self.counts.pop(path), -1)
+        for path, fdata in files.items():
+            counts = file_counts(fdata)
+            old = self.counts.get(path)
+            if old == counts:
+                continue
+            if old is not None:
+                self.add(path, old, -1)
+            self.add(path, counts)
+            self.counts[path] = counts
+
+    def directory_counts(self, directory):
+        """Return the totals of ``directory``"""
+        return self.totals.get(directory, [0, 0, 0, 0])
+
+    def worst(self, count=5, basedir=None):
+        """
+        Return the ``(directory, percent)`` of the ``count`` least covered
+        directories holding measured files (in ``basedir`` if given)
+        """
+        prefix = osp.join(basedir, '') if basedir else ''
+        ranked = sorted((counts_percent(self.totals[directory]), directory)
+                        for directory in self.direct
+                        if (directory == basedir
+                            or directory.startswith(prefix))
+                        and self.directory_counts(directory)[0])
+        return [(directory, percent) for percent, directory in ranked[:count]]
+
+
+def format_report(results, basedir):
+    """
+    Return the worker ``results`` as text, in the ``coverage report -m``
+    layout. File names are shown relative to ``basedir``.
+    """
+    branch = results.get('branch', False)
+    header = ['Name', 'Stmts', 'Miss']
+    if branch:
+        header += ['Branch', 'BrPart']
+    header += ['Cover', 'Missing']
+
+    rows = []
+    totals = [0, 0, 0, 0, 0]    # statements, missing, branches, partial, miss
+    for path, fdata in results['files'].items():
+        name = osp.relpath(path, basedir) \
+            if path.startswith(osp.join(basedir, '')) else path
+        counts = [len(fdata['statements']), len(fdata['missing']),
+                  fdata.get('branches', 0), fdata.get('partial', 0),
+                  fdata.get('missing_branches', 0)]
+        totals = [total + count for total, count in zip(totals, counts)]
+        missing = format_lines(fdata['statements'], fdata['missing'])
+        if branch:
+            arcs = format_arcs(fdata['missing_arcs'], fdata['missing'])
+            missing = ', '.join(text for text in (missing, arcs) if text)
+        rows.append((name, counts, missing))
+    rows.sort()
+    rows.append(('TOTAL', totals, ''))
+
+    lines = []
+    for name, counts, missing in rows:
+        stmts, miss, branches, partial, miss_branches = counts
+        executed, total = stmts - miss, stmts
+        row = [name, str(stmts), str(miss)]
+        if branch:
+            executed += branches - miss_branches
+            total += branches
+            row += [str(branches), str(partial)]
+        row += ['%d%%' % percent_covered(executed, total), missing]
+        lines.append(row)
+
+    width = max(len(row[0]) for row in lines + [header])
+    def format_row(row):
+        """Format a single report row"""
+        text = row[0].ljust(width)
+        text += ''.join(cell.rjust(7) for cell in row[1:-1])
+        return (text + '   ' + row[-1]).rstrip()
+    rule = '-' * len(format_row(header))
+    text = [format_row(header), rule]
+    text += [format_row(row) for row in lines[:-1]]
+    text += [rule, format_row(lines[-1])]
+    return '\n'.join(text) + '\n'
+
+
+def summarize(filename, files):
+    """Return the summary of the results ``files`` of ``filename``"""
+    summaries = dict((path, file_summary(fdata))
+                     for path, fdata in files.items())
+    counts = [sum(summary[key] for summary in summaries.values())
+              for key in ('statements', 'missing', 'branches',
+                          'missing_branches')]
+    return {'filename': filename, 'percent': counts_percent(counts),
+            'files': summaries}
+
+
+def batch(store, filenames, settings=None, project_scope=True,
+          shard_count=1, jobs=1, test_impact=True, use_cache=True,
+          python=None, data_cache=None):
+    """
+    Analyze ``filenames`` (scripts or packages), running up to ``jobs``
+    analyses at the same time, and store their results. The data of the
+    runs is kept in the ``data_cache`` (a ``DataCache``) if given.
+
+    Generates a dict per file, as soon as its analysis is finished: its
+    ``status`` (``done``, ``cached`` or ``failed``) and, unless it failed,
+    the summary of each measured file (see ``file_summary``). A ``note``
+    tells when the test impact analysis could not run.
+    """
+    settings = settings or {}
+    pending = []
+    for filename in filenames:
+        filename = osp.abspath(filename)
+        root = scope = None
+        if project_scope:
+            root = find_project_root(filename)
+            scope = get_scope(store, root)
+        job_settings = analysis_settings(settings, root, scope)
+        data = store.get(filename)
+        if use_cache and is_up_to_date(data, job_settings, filename):
+            yield dict(summarize(filename, data['files']), status='cached')
+            continue
+        modules = find_test_modules(filename) if osp.isdir(filename) else []
+        selection = None
+        if modules and test_impact:
+            selection = test_selection(store, filename, modules,
+                                       job_settings)
+        save_data = None
+        if data_cache is not None and selection is None:
+            save_data = data_cache.new_file(filename)
+        pending.append((filename, job_settings, modules, selection,
+                        save_data))
+
+    def analyze(job):
+        """Run an analysis, in a thread of the pool"""
+        filename, job_settings, modules, selection, save_data = job
+        return job, run_analysis(filename, job_settings, modules,
+                                 shard_count, selection, python, save_data)
+
+    # The analyses run in worker processes: threads only wait for them,
+    # the results being stored by this (the store's) thread
+    pool = ThreadPool(max(1, jobs))
+    try:
+        for job, (results, timings, output) in pool.imap_unordered(analyze,
+                                                                   pending):
+            filename, job_settings, modules, selection, _save_data = job
+            if results is None:
+                yield {'filename': filename, 'status': 'failed',
+                       'output': output}
+                continue
+            if modules:
+                start = time.time()
+                results = update_test_index(store, (filename, modules,
+                                                    selection), results)
+                timings.append(('impact', time.time() - start))
+            store_results(store, filename, results, job_settings, timings,
+                          modules or None)
+            result = dict(summarize(filename, results['files']),
+                          status='done', timings=dict(timings))
+            if modules and test_impact and not impact_available(job_settings):
+                result['note'] = ("branch coverage is measured: the whole "
+                                  "test suite ran, without test impact "
+                                  "analysis")
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+        if data_cache is not None:
+            data_cache.evict()
+
+
+def main(argv=None):
+    """Batch entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--store', default=default_store_path(),
+                        help="path of the results store (default: Spyder's)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of analyses run at the same time")
+    parser.add_argument('--shards', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of processes the test suite of a "
+                             "package is split into")
+    parser.add_argument('--python', default=sys.executable,
+                        help="interpreter running the code under test")
+    parser.add_argument('--keep-data', action='store_true',
+                        help="keep the data of the runs in the data cache "
+                             "next to the store, e.g. for HTML reports")
+    parser.add_argument('--force', action='store_true',
+                        help="analyze even if no source file changed")
+    parser.add_argument('--no-test-impact', action='store_true',
+                        help="always run the whole test suite of packages")
+    parser.add_argument('--no-project-scope', action='store_true',
+                        help="measure the files outside of the project too")
+    add_measure_options(parser)
+    parser.add_argument('filenames', nargs='+',
+                        help="Python scripts or packages to analyze")
+    options = parser.parse_args(argv)
+    if options.store is None:
+        parser.error("--store is required outside of Spyder")
+    # Same settings as the plugin's, so that Spyder reuses the results
+    settings = settings_from_args(options)
+    store = ResultsStore(options.store, VERSION)
+    data_cache = None
+    if options.keep_data:
+        data_cache = DataCache(data_cache_path(options.store))
+    failed = False
+    for result in batch(store, options.filenames, settings,
+                        not options.no_project_scope, options.shards,
+                        options.jobs, not options.no_test_impact,
+                        not options.force, options.python, data_cache):
+        failed = failed or result['status'] == 'failed'
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
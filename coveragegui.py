@@ -14,99 +14,1194 @@
 
 from __future__ import with_statement, print_function
 
-from spyderlib.qt.QtGui import (QHBoxLayout, QWidget,
-                                QMessageBox, QVBoxLayout, QLabel, QFont)
-from spyderlib.qt.QtCore import SIGNAL, QProcess, QByteArray, QTextCodec
+from spyderlib.qt.QtGui import (QHBoxLayout, QWidget, QMessageBox,
+                                QVBoxLayout, QLabel, QProgressBar, QTreeView,
+                                QHeaderView, QDialog, QPlainTextEdit,
+                                QTextCursor, QPainter, QColor, QMenu,
+                                QTreeWidget, QTreeWidgetItem, QLineEdit,
+                                QFormLayout, QDialogButtonBox)
+from spyderlib.qt.QtCore import (SIGNAL, Qt, QObject, QThread, QProcess,
+                                 QByteArray, QTextCodec, QAbstractItemModel,
+                                 QModelIndex, QTimer, QFileSystemWatcher)
 locale_codec = QTextCodec.codecForLocale()
-from spyderlib.qt.compat import getopenfilename
+from spyderlib.qt.compat import getopenfilename, to_qvariant
 
 import sys
 import os
 import os.path as osp
+import re
 import time
+import json
+import signal
+import shutil
+import collections
+import tempfile
 import subprocess
+import multiprocessing
 
 # Local imports
 from spyderlib import dependencies
 from spyderlib.utils import programs
 from spyderlib.utils.encoding import to_unicode_from_fs
+from spyderlib.utils.misc import get_python_executable
 from spyderlib.utils.qthelpers import get_icon, create_toolbutton
 from spyderlib.baseconfig import get_conf_path, get_translation
-from spyderlib.widgets.findreplace import FindReplace
-from spyderlib.widgets.sourcecode import codeeditor
 from spyderlib.widgets.comboboxes import (PythonModulesComboBox,
                                           is_module_or_package)
-from spyderlib.py3compat import to_text_string, getcwd, pickle
+from spyderlib.py3compat import to_text_string, getcwd
+
+from spyderplugins.widgets.coverageworker import (has_changed,
+                                                  find_test_modules,
+                                                  settings_args, split_list,
+                                                  console_code)
+from spyderplugins.widgets.coveragestore import ResultsStore, line_delta
+from spyderplugins.widgets.coveragecore import (VERSION, WORKER_PATH,
+                                                find_project_root,
+                                                is_up_to_date, get_scope,
+                                                analysis_settings,
+                                                test_selection,
+                                                impact_available,
+                                                update_test_index,
+                                                store_results,
+                                                discard_results, read_results,
+                                                job_log_path, read_job_log,
+                                                console_alive, cancel_console,
+                                                results_path, worker_timings,
+                                                measure_args, test_names,
+                                                shard_args, combine_args,
+                                                html_directory, DataCache,
+                                                data_cache_path,
+                                                line_ranges, format_range,
+                                                partial_arcs, format_arc,
+                                                percent_covered,
+                                                counts_percent, Rollups,
+                                                format_report, file_counts)
+from spyderplugins.widgets.coveragemarkers import (LineMarkers, EXECUTED,
+                                                   MISSING, PARTIAL)
 _ = get_translation("p_coverage", dirname="spyderplugins")
 
 
-COVERAGE_PATH = programs.find_program('coverage')
+PROBE_PATH = get_conf_path('coverage.probe')
 
+# Discovering coverage and probing its version are deferred until first use:
+# the version probe spawns a process, which Spyder startup should not pay for
+# a plugin that may not be used during the session.
+_coverage_path = False      # False: not looked up yet
+_dependency_registered = False
 
-def get_coverage_version():
-    """Return coverage version"""
-    global COVERAGE_PATH
-    if COVERAGE_PATH is None:
+
+def _find_package(name):
+    """
+    Return the directory of the package ``name`` of Spyder's interpreter,
+    None if it is not installed, without importing it
+    """
+    try:
+        from importlib.util import find_spec
+    except ImportError:     # Python 2
+        import imp
+        try:
+            return imp.find_module(name)[1]
+        except ImportError:
+            return None
+    spec = find_spec(name)
+    if spec is None or spec.origin is None:
+        return None
+    return osp.dirname(spec.origin)
+
+
+def get_coverage_path():
+    """
+    Return the directory of the coverage package of the interpreter the
+    worker runs in, None if it is not installed.
+
+    The worker runs in Spyder's interpreter (see ``get_python_executable``):
+    coverage is looked up in it without being imported, which would cost a
+    tenth of a second at Spyder startup.
+    """
+    global _coverage_path
+    if _coverage_path is False:
+        _coverage_path = _find_package('coverage')
+    return _coverage_path
+
+
+def _read_probe_cache(key):
+    """Return the version cached for the interpreter and package ``key``"""
+    try:
+        with open(PROBE_PATH) as fobj:
+            cache = json.load(fobj)
+        if [cache['executable'], cache['path'], cache['mtime']] == key:
+            return cache['version']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+
+def get_coverage_version(probe=True):
+    """
+    Return the version of coverage in the interpreter the worker runs in.
+
+    The version is cached on disk along with the interpreter, and the path
+    and modification time of the coverage package, so that it is probed
+    only once per install. With ``probe=False``, only the cache is looked
+    up.
+    """
+    path = get_coverage_path()
+    if path is None:
+        return
+    executable = get_python_executable()
+    key = [executable, path, os.stat(path).st_mtime]
+    vers = _read_probe_cache(key)
+    if vers is not None or not probe:
+        return vers
+    process = subprocess.Popen([executable, '-c', 'import coverage; '
+                                'print(coverage.__version__)'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = to_unicode_from_fs(process.communicate()[0])
+    match = re.match(r'\s*(\d+(\.\d+)*)', output)
+    if match is None:
         return
-    process = subprocess.Popen(['coverage', '--version'],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                               cwd=osp.dirname(COVERAGE_PATH),
-                               shell=True if os.name == 'nt' else False)
-    output = to_unicode_from_fs(process.stdout.read())
-    vers = output.split(' ')[2][:-1]
+    vers = match.group(1)
+    try:
+        with open(PROBE_PATH, 'w') as fobj:
+            json.dump(dict(executable=executable, path=path, mtime=key[2],
+                           version=vers), fobj)
+    except (IOError, OSError):
+        pass
     return vers
 
 
 COVERAGE_REQVER = '>=0.25'
-COVERAGE_VER = get_coverage_version()
-dependencies.add("coverage",
-                 _("Code coverage"),
-                 required_version=COVERAGE_REQVER,
-                 installed_version=COVERAGE_VER)
+
+
+def register_dependency(probe=True):
+    """
+    Register coverage in Spyder's dependencies.
+
+    With ``probe=False``, coverage is only registered if its version does not
+    need to be probed, i.e. if it is not installed or its version is cached:
+    otherwise, registration happens at first use.
+    """
+    global _dependency_registered
+    if _dependency_registered:
+        return
+    vers = get_coverage_version(probe)
+    if vers is None and not probe and get_coverage_path() is not None:
+        return
+    dependencies.add("coverage",
+                     _("Code coverage"),
+                     required_version=COVERAGE_REQVER,
+                     installed_version=vers)
+    _dependency_registered = True
+
+
+def format_timings(timings, compact=False):
+    """
+    Format the ``(phase, seconds)`` ``timings`` of an analysis, with their
+    total (the ``output`` phase, handled by Spyder while the worker runs,
+    is not part of it).
+
+    In ``compact`` form, the phases shorter than a tenth of the total are
+    left out.
+    """
+    total = sum(seconds for phase, seconds in timings if phase != 'output')
+    phases = ['%s %.2f' % (phase, seconds) for phase, seconds in timings
+              if not compact or seconds >= total / 10.]
+    if compact:
+        return '%.2f s (%s)' % (total, ', '.join(phases))
+    return '\n'.join([_("Total: %.2f s") % total] +
+                     [phase + ' s' for phase in phases])
+
+
+class OutputBuffer(object):
+    """
+    Ring buffer of process output, bounded to ``max_size`` characters: the
+    oldest output is dropped first.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.chunks = collections.deque()
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, text):
+        """Append ``text``, dropping old output if needed"""
+        if len(text) > self.max_size:
+            self.dropped += len(text) - self.max_size
+            text = text[-self.max_size:]
+        self.chunks.append(text)
+        self.size += len(text)
+        while self.size > self.max_size:
+            chunk = self.chunks.popleft()
+            excess = self.size - self.max_size
+            if len(chunk) > excess:
+                self.chunks.appendleft(chunk[excess:])
+                chunk = chunk[:excess]
+            self.size -= len(chunk)
+            self.dropped += len(chunk)
+
+    def clear(self):
+        """Remove all output"""
+        self.chunks.clear()
+        self.size = self.dropped = 0
+
+    def text(self):
+        """Return the buffered output"""
+        text = ''.join(self.chunks)
+        if self.dropped:
+            text = (_("[%d characters dropped]") % self.dropped) + '\n' + text
+        return text
+
+
+class OutputLog(QDialog):
+    """
+    Non-modal viewer of the output of the running (or last) analysis,
+    updated as the output comes.
+    """
+    MAX_LINES = 20000
+
+    def __init__(self, parent):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle(_("Coverage output"))
+        self.resize(700, 500)
+        self.editor = QPlainTextEdit(self)
+        self.editor.setReadOnly(True)
+        self.editor.setMaximumBlockCount(self.MAX_LINES)
+        layout = QVBoxLayout()
+        layout.addWidget(self.editor)
+        self.setLayout(layout)
+
+    def set_text(self, text):
+        """Replace the displayed output"""
+        self.editor.setPlainText(text)
+        self.editor.moveCursor(QTextCursor.End)
+
+    def append(self, text):
+        """Append output, following it if the view is at the end"""
+        scrollbar = self.editor.verticalScrollBar()
+        at_end = scrollbar.value() == scrollbar.maximum()
+        cursor = QTextCursor(self.editor.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        if at_end:
+            scrollbar.setValue(scrollbar.maximum())
+
+
+class CoverageServer(QObject):
+    """
+    Warm coverage worker: a persistent ``coverageworker.py --server`` process.
+
+    The server keeps coverage and the heavy installed packages (numpy,
+    pandas...) imported and forks a clean child for each job, so repeated
+    analyses skip the interpreter startup and those imports. It restarts
+    itself when one of the pre-imported source files changes.
+
+    Only available on platforms providing ``os.fork``.
+    """
+    def __init__(self, parent, preload=''):
+        QObject.__init__(self, parent)
+        self.preload = preload
+        self.process = None
+        self.jobs = {}          # job id -> job, until the job is finished
+        self.pids = {}          # job id -> pid of the forked child
+        self.cancelled = set()
+        self.counter = 0
+
+    @staticmethod
+    def is_supported():
+        """Return True if the fork server can run on this platform"""
+        return hasattr(os, 'fork')
+
+    def is_running(self):
+        """Return True if the server process is running"""
+        return self.process is not None \
+            and self.process.state() != QProcess.NotRunning
+
+    def start(self):
+        """Start the server process, resubmitting the pending jobs"""
+        process = QProcess(self)
+        process.setProcessChannelMode(QProcess.SeparateChannels)
+        decoder = locale_codec.makeDecoder()
+        # Bound to the process: a restarted or shut down server may still
+        # signal
+        self.connect(process, SIGNAL("readyReadStandardOutput()"),
+                     lambda: self.read_replies(process))
+        self.connect(process, SIGNAL("readyReadStandardError()"),
+                     lambda: self.read_output(process, decoder))
+        self.connect(process, SIGNAL("finished(int,QProcess::ExitStatus)"),
+                     lambda: self.server_finished(process))
+        self.process = process
+        self.pids = {}
+        p_args = [WORKER_PATH, '--server', '--preload', self.preload]
+        self.process.start(get_python_executable(), p_args)
+        for job_id in sorted(self.jobs):
+            self.send(self.jobs[job_id])
+
+    def shutdown(self):
+        """Stop the server and the running jobs"""
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        if self.is_running():
+            process, self.process = self.process, None
+            process.kill()
+
+    def send(self, job):
+        """Send a job to the server"""
+        line = json.dumps(job) + '\n'
+        self.process.write(QByteArray(line.encode('ascii')))
+
+    def submit(self, filename, args, cwd, output, settings=None,
+               save_data=None):
+        """
+        Submit a job: measure ``filename`` run with ``args`` in ``cwd``,
+        writing the results to ``output`` and the output of the script to
+        ``job_log_path(output)``. ``settings`` are the measurement settings
+        (see ``coverageworker.create_coverage``). The data is also saved to
+        ``save_data`` if given.
+
+        Returns the job id, passed along with the exit status in the
+        ``job_finished(int,int)`` signal.
+        """
+        if not self.is_running():
+            self.start()
+        self.counter += 1
+        job = dict(id=self.counter, filename=filename, args=list(args),
+                   cwd=cwd, output=output, log=job_log_path(output),
+                   settings=settings, save_data=save_data)
+        self.jobs[job['id']] = job
+        self.send(job)
+        return job['id']
+
+    def cancel(self, job_id):
+        """Cancel a job: its ``job_finished`` signal will not be emitted"""
+        if job_id not in self.jobs:
+            return
+        self.cancelled.add(job_id)
+        pid = self.pids.get(job_id)
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def read_output(self, process, decoder):
+        """
+        Forward the output of a server itself (its stderr), e.g. the errors
+        of its preloaded modules: the jobs write theirs to their own file
+        """
+        qba = process.readAllStandardError()
+        text = to_text_string(decoder.toUnicode(qba))
+        self.emit(SIGNAL("server_output(QString)"), text)
+
+    def read_replies(self, process):
+        """
+        Process the replies of the server (JSON lines on stdout), ignoring
+        those of a former server: its unfinished jobs were resubmitted
+        """
+        if process is not self.process:
+            process.readAllStandardOutput()
+            return
+        process.setReadChannel(QProcess.StandardOutput)
+        while process.canReadLine():
+            line = process.readLine().data().decode('ascii')
+            reply = json.loads(line)
+            job_id = reply.get('id')
+            if 'stale' in reply:
+                # The server exits: resubmit everything to a new one
+                self.start()
+                return
+            elif 'pid' in reply:
+                self.pids[job_id] = reply['pid']
+                if job_id in self.cancelled:
+                    self.cancel(job_id)
+            elif 'returncode' in reply:
+                self.job_done(job_id, reply['returncode'])
+
+    def job_done(self, job_id, returncode):
+        """Forget about a finished job and notify the client"""
+        job = self.jobs.pop(job_id, None)
+        self.pids.pop(job_id, None)
+        if job_id in self.cancelled:
+            self.cancelled.discard(job_id)
+            if job is not None:
+                discard_results(job['output'])
+                discard_results(job['log'])
+        else:
+            self.emit(SIGNAL("job_finished(int,int)"), job_id, returncode)
+
+    def server_finished(self, process):
+        """The server process died: fail its pending jobs"""
+        process.deleteLater()
+        if process is not self.process:
+            # restarted after a stale reply, or shut down
+            return
+        self.process = None
+        for job_id in sorted(self.jobs):
+            self.job_done(job_id, -1)
+
+
+class ShardedRun(QObject):
+    """
+    Coverage of a test suite split into shards run in parallel.
+
+    Each shard is a worker process running some of the test modules and
+    saving its data to a parallel-mode data file; when all of them are
+    finished, a last worker combines the data files into the results file.
+
+    ``names`` are test module paths or test ids. The ``extra_files`` are
+    analyzed even if none of the tests runs them. ``settings`` are the
+    measurement settings (see ``coverageworker.create_coverage``). The
+    combined data is also saved to ``save_data`` if given.
+
+    Emits ``output(QString)`` with the output of the processes,
+    ``progress(int,int)`` with the numbers of finished and total shards,
+    ``finished()`` once the results file is written, and ``cleaned_up()``
+    once the processes of a killed run are finished and its files removed.
+    """
+    def __init__(self, parent, package, names, count, output,
+                 extra_files=(), settings=None, save_data=None):
+        QObject.__init__(self, parent)
+        self.package = package
+        self.tempdir = tempfile.mkdtemp(prefix='coverage-')
+        data_file = osp.join(self.tempdir, '.coverage')
+        # Worker arguments, shared with ``coveragecore.run_analysis``
+        self.shards = shard_args(names, count, data_file, settings)
+        self.combine_args = combine_args(package, data_file, output,
+                                         extra_files, settings, save_data)
+        self.output = output
+        self.processes = []
+        self.done = 0
+        self.cancelled = False
+
+    def start_process(self, p_args):
+        """Start a worker process with arguments ``p_args``"""
+        process = QProcess(self)
+        process.setProcessChannelMode(QProcess.MergedChannels)
+        process.setWorkingDirectory(self.package)
+        decoder = locale_codec.makeDecoder()
+        self.connect(process, SIGNAL("readyReadStandardOutput()"),
+                     lambda: self.read_output(process, decoder))
+        self.connect(process, SIGNAL("finished(int,QProcess::ExitStatus)"),
+                     self.process_ended)
+        self.processes.append(process)
+        process.start(get_python_executable(), [WORKER_PATH] + p_args)
+        return process
+
+    def start(self):
+        """Start the shards"""
+        if not self.shards:
+            self.combine()
+        for p_args in self.shards:
+            process = self.start_process(p_args)
+            self.connect(process,
+                         SIGNAL("finished(int,QProcess::ExitStatus)"),
+                         self.shard_finished)
+
+    def kill(self):
+        """
+        Kill the processes, without waiting for them: the data files are
+        removed once all of them are finished
+        """
+        self.cancelled = True
+        for process in self.processes:
+            process.kill()
+        self.process_ended()
+
+    def process_ended(self):
+        """Clean up once all the processes of a cancelled run are finished"""
+        if self.cancelled and all(process.state() == QProcess.NotRunning
+                                  for process in self.processes):
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+            discard_results(self.output)
+            self.emit(SIGNAL("cleaned_up()"))
+            self.deleteLater()
+
+    def read_output(self, process, decoder):
+        """Forward the output of ``process``"""
+        qba = process.readAllStandardOutput()
+        text = to_text_string(decoder.toUnicode(qba))
+        self.emit(SIGNAL("output(QString)"), text)
+
+    def shard_finished(self):
+        """A shard is finished: combine the data once all of them are"""
+        if self.cancelled:
+            return
+        self.done += 1
+        self.emit(SIGNAL("progress(int,int)"), self.done, len(self.shards))
+        if self.done == len(self.shards):
+            self.combine()
+
+    def combine(self):
+        """Combine the data files of the shards into the results file"""
+        process = self.start_process(self.combine_args)
+        self.connect(process, SIGNAL("finished(int,QProcess::ExitStatus)"),
+                     self.combine_finished)
+
+    def combine_finished(self):
+        """The results file is written"""
+        if self.cancelled:
+            return
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        self.emit(SIGNAL("finished()"))
+
+
+class AnalysisJob(QObject):
+    """
+    An analysis: the coverage of a file, measured by a worker process, by
+    the warm worker (``CoverageServer``) or in a console of Spyder, or of the
+    test suite of a package (``ShardedRun``).
+
+    Emits ``output(QString)`` with the output of the analysis,
+    ``status_changed()``, and ``finished()`` once it is done, failed or
+    cancelled. The results of a successful analysis are in ``results``,
+    and its data in the ``save_data`` file if given.
+    """
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = range(5)
+    OUTPUT_MAX_SIZE = 2 ** 20
+    ERROR_MAX_SIZE = 2 ** 14
+    POLL_INTERVAL = 200     # ms, results file polling of console analyses
+
+    def __init__(self, parent, filename, settings=None, save_data=None):
+        QObject.__init__(self, parent)
+        self.filename = filename
+        # Measurement settings (see ``coverageworker.create_coverage``)
+        self.settings = settings
+        self.save_data = save_data
+        self.status = self.QUEUED
+        self.progress = None    # numbers of finished and total shards
+        self.results = None
+        # Durations of the phases of the analysis, as (phase, seconds)
+        self.timings = []
+        self.started = None
+        self.shards_done = None
+        self.output_time = 0
+        self.impact = None      # (package, test modules, selection)
+        # All the output, in arrival order, and standard error only (shown
+        # if the analysis fails)
+        self.output = OutputBuffer(self.OUTPUT_MAX_SIZE)
+        self.error_output = OutputBuffer(self.ERROR_MAX_SIZE)
+        self.decoders = {False: locale_codec.makeDecoder(),
+                         True: locale_codec.makeDecoder()}
+        self.results_path = None
+        self.process = None
+        self.server = None
+        self.server_job = None
+        self.sharded = None
+        self.console_timer = None
+
+    def is_active(self):
+        """Return True if the analysis is queued or running"""
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def status_text(self):
+        """Return the status, as shown to the user"""
+        if self.status == self.RUNNING and self.progress is not None:
+            return _("running (%d/%d shards)") % self.progress
+        return {self.QUEUED: _("queued"), self.RUNNING: _("running"),
+                self.DONE: _("done"), self.FAILED: _("failed"),
+                self.CANCELLED: _("cancelled")}[self.status]
+
+    def set_status(self, status):
+        """Set the status of the analysis"""
+        self.status = status
+        self.emit(SIGNAL("status_changed()"))
+
+    def prepare(self):
+        """Create the results file and mark the analysis as running"""
+        self.started = time.time()
+        self.results_path = results_path()
+        self.set_status(self.RUNNING)
+
+    def start_process(self):
+        """
+        Run ``coverageworker.py <filename>`` as a separate process: the
+        worker runs the file under coverage and writes the measured data to
+        ``self.results_path``
+        """
+        self.prepare()
+        self.process = QProcess(self)
+        self.process.setProcessChannelMode(QProcess.SeparateChannels)
+        self.process.setWorkingDirectory(osp.dirname(self.filename))
+        self.connect(self.process, SIGNAL("readyReadStandardOutput()"),
+                     self.read_output)
+        self.connect(self.process, SIGNAL("readyReadStandardError()"),
+                     lambda: self.read_output(error=True))
+        self.connect(self.process,
+                     SIGNAL("finished(int,QProcess::ExitStatus)"),
+                     self.process_finished)
+        self.process.start(get_python_executable(), [WORKER_PATH]
+                           + measure_args(self.filename, self.results_path,
+                                          self.settings, self.save_data))
+        if not self.process.waitForStarted():
+            # No finished signal follows a failed start
+            self.process.deleteLater()
+            self.process = None
+            self.append_output(_("Process failed to start"), error=True)
+            self.finish()
+
+    def start_server(self, server):
+        """
+        Run the analysis in the warm worker ``server``. The output of the
+        file is written to a file of its own, shown once it is finished.
+        """
+        self.prepare()
+        self.server = server
+        self.connect(server, SIGNAL("server_output(QString)"),
+                     self.read_server_output)
+        self.connect(server, SIGNAL("job_finished(int,int)"),
+                     self.server_job_finished)
+        self.server_job = server.submit(self.filename, [],
+                                        osp.dirname(self.filename),
+                                        self.results_path, self.settings,
+                                        self.save_data)
+
+    def start_console(self, execute):
+        """
+        Run the analysis in a console of Spyder, ``execute`` being the
+        function executing a line of code in it and returning False if there
+        is no console: the file is run in the namespace of the console,
+        reusing the modules it imported (see
+        ``coverageworker.measure_in_console``).
+
+        The output of the file is shown in the console. The console does not
+        report the end of the code it runs: the results file, written once
+        complete, is polled for, until the console is found dead or busy
+        (see ``coveragecore.console_alive``).
+
+        Returns False if there is no console, the analysis being left to
+        another method.
+        """
+        self.prepare()
+        # Only written by the worker once complete
+        discard_results(self.results_path)
+        if not execute(console_code(self.filename, self.results_path,
+                                    self.settings, self.save_data)):
+            return False
+        self.console_timer = QTimer(self)
+        self.connect(self.console_timer, SIGNAL("timeout()"),
+                     self.poll_console)
+        self.console_timer.start(self.POLL_INTERVAL)
+        return True
+
+    def poll_console(self):
+        """Check whether the analysis run in a console is finished"""
+        if not osp.exists(self.results_path):
+            if console_alive(self.results_path, self.started):
+                return
+            cancel_console(self.results_path)
+            self.append_output(_("The console did not run the analysis, or "
+                                 "stopped responding"), error=True)
+        self.stop_console_timer()
+        self.finish()
+
+    def stop_console_timer(self):
+        """Stop polling for the results of the analysis run in a console"""
+        self.console_timer.stop()
+        self.console_timer.deleteLater()
+        self.console_timer = None
+
+    def start_sharded(self, modules, count, selection=None):
+        """
+        Run the test ``modules`` of the package in ``count`` parallel
+        processes (see ``ShardedRun``).
+
+        If a test impact ``selection`` is given, only the selected tests are
+        run, their results having to be merged with the stored ones.
+        """
+        self.prepare()
+        self.impact = (osp.abspath(self.filename), modules, selection)
+        names, extra_files = test_names(modules, selection)
+        self.sharded = ShardedRun(self, self.filename, names, count,
+                                  self.results_path, extra_files,
+                                  self.settings, self.save_data)
+        self.connect(self.sharded, SIGNAL("output(QString)"),
+                     lambda text: self.append_output(to_text_string(text),
+                                                     error=True))
+        self.connect(self.sharded, SIGNAL("progress(int,int)"),
+                     self.show_progress)
+        self.connect(self.sharded, SIGNAL("finished()"),
+                     self.sharded_finished)
+        self.connect(self.sharded, SIGNAL("cleaned_up()"),
+                     self.sharded_cleaned_up)
+        self.show_progress(0, len(self.sharded.shards))
+        self.sharded.start()
+
+    def append_output(self, text, error=False):
+        """Append output of the analysis"""
+        start = time.time()
+        self.output.append(text)
+        if error:
+            self.error_output.append(text)
+        self.emit(SIGNAL("output(QString)"), text)
+        self.output_time += time.time() - start
+
+    def read_output(self, error=False):
+        """
+        Read the output of the worker process, both standard and error.
+
+        Everything available is read, so that the pipes never fill up.
+        """
+        start = time.time()
+        if error:
+            qba = self.process.readAllStandardError()
+        else:
+            qba = self.process.readAllStandardOutput()
+        if self.status == self.RUNNING:
+            text = to_text_string(self.decoders[error].toUnicode(qba))
+            self.output_time += time.time() - start
+            self.append_output(text, error)
+
+    def read_server_output(self, text):
+        """
+        Read the output of the warm worker itself, shared by the jobs running
+        at the same time
+        """
+        if self.server_job is not None:
+            self.append_output(to_text_string(text), error=True)
+
+    def show_progress(self, done, total):
+        """Show the progress of a sharded run"""
+        self.progress = (done, total)
+        if done == total:
+            self.shards_done = time.time()
+        self.emit(SIGNAL("status_changed()"))
+
+    def process_finished(self):
+        """The worker process is finished"""
+        self.process.deleteLater()
+        self.process = None
+        if self.status == self.RUNNING:
+            self.finish()
+        else:
+            # Cancelled
+            discard_results(self.results_path)
+            self.discard_data()
+
+    def server_job_finished(self, job_id, _returncode):
+        """A warm worker job is finished"""
+        if job_id == self.server_job:
+            self.server_job = None
+            data = read_job_log(self.results_path)
+            if data:
+                text = self.decoders[True].toUnicode(QByteArray(data))
+                self.append_output(to_text_string(text), error=True)
+            self.finish()
+
+    def sharded_finished(self):
+        """The sharded run is finished"""
+        self.sharded = None
+        self.finish()
+
+    def sharded_cleaned_up(self):
+        """The sharded run of the cancelled analysis is cleaned up"""
+        self.sharded = None
+
+    def finish(self):
+        """Read the results and the timings of the worker"""
+        end = time.time()
+        self.results = read_results(self.results_path)
+        worker = {}
+        if self.results is not None:
+            worker = self.results.pop('timings', {})
+        self.timings = worker_timings(worker, self.started, end,
+                                      self.shards_done)
+        self.timings.append(('read', time.time() - end))
+        self.timings.append(('output', self.output_time))
+        self.set_status(self.FAILED if self.results is None else self.DONE)
+        self.emit(SIGNAL("finished()"))
+
+    def cancel(self):
+        """
+        Cancel the analysis. This does not wait for the processes to die:
+        they are killed, and cleaned up when they are finished.
+        """
+        if not self.is_active():
+            return
+        if self.sharded is not None:
+            # Kept until it is cleaned up (see ``sharded_cleaned_up``)
+            self.sharded.kill()
+        if self.server_job is not None:
+            self.server.cancel(self.server_job)
+            self.server_job = None
+            discard_results(self.results_path)
+        if self.process is not None:
+            # Its results and data are discarded by process_finished
+            self.process.kill()
+        if self.console_timer is not None:
+            # The code run in a console cannot be stopped from here: it
+            # discards its results and data itself
+            self.stop_console_timer()
+            cancel_console(self.results_path)
+        if self.process is None:
+            self.discard_data()
+        self.set_status(self.CANCELLED)
+        self.emit(SIGNAL("finished()"))
+
+    def discard_data(self):
+        """Remove the data file of the cancelled analysis, if any"""
+        if self.save_data is not None:
+            discard_results(self.save_data)
+            self.save_data = None
+
+
+class JobsWindow(QTreeWidget):
+    """
+    List of the queued, running and last finished analyses.
+
+    Double-clicking an analysis emits ``job_selected(QString)`` with its
+    file; the context menu cancels it.
+    """
+    def __init__(self, parent):
+        QTreeWidget.__init__(self, parent)
+        self.setHeaderLabels([_("Analysis"), _("Status")])
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True)
+        self.header().setStretchLastSection(False)
+        self.header().setResizeMode(0, QHeaderView.Stretch)
+        self.header().setResizeMode(1, QHeaderView.ResizeToContents)
+        self.setMaximumHeight(120)
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.connect(self, SIGNAL("customContextMenuRequested(QPoint)"),
+                     self.show_menu)
+        self.connect(self, SIGNAL("itemActivated(QTreeWidgetItem*,int)"),
+                     self.activated)
+        self.jobs = []      # (job, item) pairs
+        self.hide()
+
+    def find_job(self, item):
+        """Return the job of ``item``"""
+        for job, job_item in self.jobs:
+            if job_item is item:
+                return job
+
+    def add_job(self, job):
+        """Add ``job`` at the end of the list"""
+        item = QTreeWidgetItem([job.filename, job.status_text()])
+        self.addTopLevelItem(item)
+        self.jobs.append((job, item))
+        self.show()
+
+    def update_job(self, job):
+        """Show the status of ``job``"""
+        for other, item in self.jobs:
+            if other is job:
+                item.setText(1, job.status_text())
+
+    def remove_job(self, job):
+        """Remove ``job`` from the list"""
+        for index, (other, item) in enumerate(self.jobs):
+            if other is job:
+                self.takeTopLevelItem(self.indexOfTopLevelItem(item))
+                del self.jobs[index]
+                break
+        self.setVisible(bool(self.jobs))
+
+    def show_menu(self, pos):
+        """Show the context menu of the analysis at ``pos``"""
+        job = self.find_job(self.itemAt(pos))
+        menu = QMenu(self)
+        cancel_action = menu.addAction(_("Cancel"))
+        cancel_action.setEnabled(job is not None and job.is_active())
+        clear_action = menu.addAction(_("Remove finished analyses"))
+        action = menu.exec_(self.viewport().mapToGlobal(pos))
+        if action is cancel_action:
+            job.cancel()
+        elif action is clear_action:
+            self.emit(SIGNAL("clear_finished()"))
+
+    def activated(self, item, _column):
+        """Select the file of the analysis of ``item``"""
+        job = self.find_job(item)
+        if job is not None:
+            self.emit(SIGNAL("job_selected(QString)"), job.filename)
+
+
+class HistoryValidator(QThread):
+    """
+    Checks in the background that the files of the results history still
+    exist, so that a long history (possibly on network drives) does not slow
+    down Spyder's startup.
+
+    Emits ``validated(PyQt_PyObject,PyQt_PyObject)`` with the lists of valid
+    and obsolete filenames, by batches, in history order.
+    """
+    BATCH_SIZE = 20
+
+    def __init__(self, parent, filenames):
+        QThread.__init__(self, parent)
+        self.filenames = filenames
+
+    def run(self):
+        """Check the files"""
+        valid, obsolete = [], []
+        for filename in self.filenames:
+            if is_module_or_package(filename):
+                valid.append(filename)
+            else:
+                obsolete.append(filename)
+            if len(valid) + len(obsolete) >= self.BATCH_SIZE:
+                self.emit(SIGNAL("validated(PyQt_PyObject,PyQt_PyObject)"),
+                          valid, obsolete)
+                valid, obsolete = [], []
+        self.emit(SIGNAL("validated(PyQt_PyObject,PyQt_PyObject)"),
+                  valid, obsolete)
+
+
+class ResultsNode(object):
+    """
+    Node of the results tree: a package (directory), a module, or a range
+    of missing lines or a partial branch of a module.
+
+    Children are only built when the tree view asks for them. The counts of
+    packages are looked up in the ``rollups`` of the results (see
+    ``Rollups``), given to the root node.
+    """
+    PACKAGE, MODULE, LINES = range(3)
+
+    def __init__(self, parent, kind, name, path=None, items=None,
+                 fdata=None, line=None, rollups=None):
+        self.parent = parent
+        self.rollups = rollups if parent is None else parent.rollups
+        self.kind = kind
+        self.name = name
+        self.path = path        # package directory or module file
+        self.items = items      # package: [(path parts, path, fdata)]
+        self.fdata = fdata      # module: worker data
+        self.line = line        # lines: first line
+        self.children = None
+        self.row = 0
+        if kind == self.PACKAGE:
+            if parent is None:
+                self.counts = self.rollups.total
+            else:
+                self.counts = self.rollups.directory_counts(path)
+        elif kind == self.MODULE:
+            self.counts = file_counts(fdata)
+        else:
+            self.counts = None
+
+    def may_have_children(self):
+        """Return True if the node may have children, without building them"""
+        if self.kind == self.PACKAGE:
+            return bool(self.items)
+        elif self.kind == self.MODULE:
+            return self.counts[1] > 0 or self.counts[3] > 0
+        return False
+
+    def build_children(self):
+        """Return the child nodes"""
+        if self.kind == self.PACKAGE:
+            subitems = {}
+            children = []
+            for parts, path, fdata in self.items:
+                if len(parts) == 1:
+                    children.append(ResultsNode(self, self.MODULE, parts[0],
+                                                path=path, fdata=fdata))
+                else:
+                    subitems.setdefault(parts[0], []).append((parts[1:], path,
+                                                              fdata))
+            for name, items in subitems.items():
+                children.append(ResultsNode(self, self.PACKAGE, name,
+                                            path=osp.join(self.path, name),
+                                            items=items))
+            return children
+        elif self.kind == self.MODULE:
+            statements, missing = self.fdata['statements'], \
+                self.fdata['missing']
+            children = [ResultsNode(self, self.LINES, format_range(start, end),
+                                    line=start)
+                        for start, end in line_ranges(statements, missing)]
+            children += [ResultsNode(self, self.LINES, format_arc(start, end),
+                                     line=start)
+                         for start, end in
+                         partial_arcs(self.fdata.get('missing_arcs', []),
+                                      missing)]
+            return children
+        return []
+
+    def percent(self):
+        """Return the covered percentage"""
+        return counts_percent(self.counts)
+
+    def sort_key(self, column):
+        """Return the key sorting this node on ``column``"""
+        if self.kind == self.LINES:
+            return self.line
+        elif column == 1:
+            return self.counts[0]
+        elif column == 2:
+            return self.counts[1]
+        elif column == 3:
+            return self.percent()
+        return self.name.lower()
+
+
+class ResultsModel(QAbstractItemModel):
+    """
+    Coverage results tree model: package -> module -> missing lines.
+
+    Nodes are built lazily, when the view needs them, so that results
+    covering thousands of modules are displayed instantly; sorting only
+    reorders the nodes that were built. The totals of the packages are kept
+    in ``rollups``, only updated for the modules whose counts changed when
+    new results are set.
+    """
+    NAME, STATEMENTS, MISSING, COVER = range(4)
+
+    def __init__(self, parent):
+        QAbstractItemModel.__init__(self, parent)
+        self.columns = (_("Name"), _("Stmts"), _("Miss"), _("Cover"))
+        self.rollups = Rollups()
+        self.root = ResultsNode(None, ResultsNode.PACKAGE, '', items=[],
+                                rollups=self.rollups)
+        self.sort_column = self.NAME
+        self.sort_order = Qt.AscendingOrder
+
+    def set_files(self, files, basedir):
+        """Set the worker data of the measured ``files``"""
+        items = []
+        for path, fdata in files.items():
+            if path.startswith(osp.join(basedir, '')):
+                parts = osp.relpath(path, basedir).split(os.sep)
+            else:
+                parts = [path]
+            items.append((parts, path, fdata))
+        self.rollups.update(files)
+        self.beginResetModel()
+        self.root = ResultsNode(None, ResultsNode.PACKAGE, '', path=basedir,
+                                items=items, rollups=self.rollups)
+        self.endResetModel()
+
+    def node(self, index):
+        """Return the node of ``index``"""
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def children(self, node):
+        """Return the children of ``node``, building them if needed"""
+        if node.children is None:
+            node.children = node.build_children()
+            self.sort_children(node)
+        return node.children
+
+    def sort_children(self, node):
+        """Sort the children of ``node`` according to the sort column"""
+        node.children.sort(key=lambda child: child.sort_key(self.sort_column),
+                           reverse=self.sort_order == Qt.DescendingOrder)
+        for row, child in enumerate(node.children):
+            child.row = row
+
+    #------ QAbstractItemModel API --------------------------------------------
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column,
+                                self.children(self.node(parent))[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        node = index.internalPointer().parent
+        if node is None or node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.children(self.node(parent)))
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.columns)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if node.children is None:
+            return node.may_have_children()
+        return bool(node.children)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return to_qvariant()
+        node, column = index.internalPointer(), index.column()
+        if role == Qt.DisplayRole:
+            if column == self.NAME:
+                return to_qvariant(node.name)
+            elif node.counts is None:
+                return to_qvariant()
+            elif column == self.COVER:
+                return to_qvariant('%d%%' % node.percent())
+            return to_qvariant(str(node.counts[column - 1]))
+        elif role == Qt.TextAlignmentRole and column != self.NAME:
+            return to_qvariant(int(Qt.AlignRight | Qt.AlignVCenter))
+        elif role == Qt.ToolTipRole and node.path is not None:
+            return to_qvariant(node.path)
+        return to_qvariant()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return to_qvariant(self.columns[section])
+        return to_qvariant()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort the built nodes, keeping the selection and expanded nodes"""
+        self.emit(SIGNAL("layoutAboutToBeChanged()"))
+        self.sort_column, self.sort_order = column, order
+        old_indexes = self.persistentIndexList()
+        nodes = [(index.internalPointer(), index.column())
+                 for index in old_indexes]
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            if node.children is not None:
+                self.sort_children(node)
+                pending.extend(node.children)
+        self.changePersistentIndexList(old_indexes,
+                                       [self.createIndex(node.row, column,
+                                                         node)
+                                        for node, column in nodes])
+        self.emit(SIGNAL("layoutChanged()"))
 
 
 class ResultsWindow(QWidget):
     """
-    Simple read-only editor that contains the coverage results.
+    Tree of the coverage results: packages, modules and their missing lines.
 
-    Will eventually replace with a tree structure so that you can "drill down"
-    into the various modules. Will provide all the information that
-    ``coverage html`` provides.
+    Double-clicking a module or a range of missing lines opens it in the
+    editor (``edit_goto(QString,int,QString)`` signal).
     """
     def __init__(self, parent):
         """
         __init__(self, QWidget parent) -> QWidget
         """
         QWidget.__init__(self, parent)
-        self.editor = None
         self.filename = None
         self.results = None
-        self.data = None
-#        self.setWindowTitle("Hello")
-
-        self.editor = codeeditor.CodeEditor(self)
-        self.editor.setup_editor(linenumbers=False, language='py',
-                                 scrollflagarea=False, edge_line=False)
-        self.editor.set_font(QFont('Consolas'))
-
-        self.connect(self.editor, SIGNAL("focus_changed()"),
-                     lambda: self.emit(SIGNAL("focus_changed()")))
-        self.editor.setReadOnly(True)
 
-        # Find/replace widget
-        self.find_widget = FindReplace(self)
-        self.find_widget.set_editor(self.editor)
-        self.find_widget.hide()
+        self.model = ResultsModel(self)
+        self.tree = QTreeView(self)
+        self.tree.setUniformRowHeights(True)
+        self.tree.setModel(self.model)
+        self.tree.setSortingEnabled(True)
+        self.tree.sortByColumn(ResultsModel.NAME, Qt.AscendingOrder)
+        self.tree.header().setStretchLastSection(False)
+        self.tree.header().setResizeMode(ResultsModel.NAME,
+                                         QHeaderView.Stretch)
+        self.connect(self.tree, SIGNAL("activated(QModelIndex)"),
+                     self.activated)
 
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
-        layout.addWidget(self.editor)
-        layout.addWidget(self.find_widget)
+        layout.addWidget(self.tree)
         self.setLayout(layout)
 
     def clear_results(self):
         """ Remove the results from the screen """
-        self.editor.clear()
+        self.filename = None
+        self.results = None
+        self.model.set_files({}, '')
 
     def set_results(self, filename, results):
         """ Set instance attributes for filename and results """
@@ -115,12 +1210,301 @@ class ResultsWindow(QWidget):
         self.refresh()
 
     def refresh(self):
-        """ Refresh the widget, printing the results to the screen """
-#        title = _("Results for ") + self.filename       # What's this code?
-        self.editor.clear()
-#        self.data = "Fake data!"
-        self.data = self.results
-        self.editor.set_text(self.data)
+        """ Refresh the widget, displaying the results tree """
+        basedir = osp.dirname(osp.abspath(self.filename))
+        self.model.set_files(self.results, basedir)
+
+    def activated(self, index):
+        """ Open the module or missing lines of ``index`` in the editor """
+        node = index.internalPointer()
+        if node.kind == ResultsNode.MODULE:
+            lines = node.fdata['missing'] or [1]
+            self.emit(SIGNAL("edit_goto(QString,int,QString)"),
+                      node.path, lines[0], '')
+        elif node.kind == ResultsNode.LINES:
+            self.emit(SIGNAL("edit_goto(QString,int,QString)"),
+                      node.parent.path, node.line, '')
+
+
+class DeltaItem(QTreeWidgetItem):
+    """
+    File of the coverage changes, sorted by the numbers of its columns rather
+    than by their texts (``sort_keys``)
+    """
+    def __init__(self, texts, sort_keys):
+        QTreeWidgetItem.__init__(self, texts)
+        self.sort_keys = sort_keys
+
+    def __lt__(self, other):
+        column = self.treeWidget().sortColumn()
+        return self.sort_keys[column] < other.sort_keys[column]
+
+
+class DeltaWindow(QDialog):
+    """
+    Changes of coverage between two runs: the files whose coverage changed,
+    with the lines that gained or lost coverage (found when a file is
+    expanded).
+
+    Double-clicking a file or a range of lines opens it in the editor
+    (``edit_goto(QString,int,QString)`` signal).
+    """
+    def __init__(self, parent):
+        QDialog.__init__(self, parent)
+        self.resize(700, 500)
+        self.tree = QTreeWidget(self)
+        self.tree.setHeaderLabels([_("Name"), _("Before"), _("After"),
+                                   _("Executed lines")])
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setStretchLastSection(False)
+        self.tree.header().setResizeMode(0, QHeaderView.Stretch)
+        self.connect(self.tree, SIGNAL("itemActivated(QTreeWidgetItem*,int)"),
+                     self.activated)
+        self.connect(self.tree, SIGNAL("itemExpanded(QTreeWidgetItem*)"),
+                     self.expand_lines)
+        self.label = QLabel(self)
+        layout = QVBoxLayout()
+        layout.addWidget(self.label)
+        layout.addWidget(self.tree)
+        self.setLayout(layout)
+
+    def set_delta(self, delta, basedir, date):
+        """
+        Show the ``delta`` of the results of ``basedir`` since the run of
+        ``date`` (see ``coveragestore.compare_files``)
+        """
+        self.setWindowTitle(_("Coverage changes since %s")
+                            % time.strftime("%d %b %Y %H:%M", date))
+        self.tree.clear()
+        self.tree.setSortingEnabled(False)
+        executed = [0, 0]
+        for path, fdelta in delta.items():
+            name = osp.relpath(path, basedir) \
+                if path.startswith(osp.join(basedir, '')) else path
+            counts = [fcounts[0] if fcounts else 0
+                      for fcounts in (fdelta['before'], fdelta['after'])]
+            # A file missing from a run comes before a 0% covered one
+            percents = [percent_covered(*fcounts) if fcounts else -1
+                        for fcounts in (fdelta['before'], fdelta['after'])]
+            item = DeltaItem(
+                [name] + ['%d%%' % percent if percent >= 0 else '-'
+                          for percent in percents]
+                + ['%+d' % (counts[1] - counts[0])],
+                [name] + percents + [counts[1] - counts[0]])
+            item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            # The lines are only found when needed (see ``item_lines``)
+            item.fdelta = fdelta
+            item.lines = None
+            item.location = (path, None)
+            executed[0] += counts[0]
+            executed[1] += counts[1]
+            self.tree.addTopLevelItem(item)
+        self.tree.setSortingEnabled(True)
+        self.tree.sortByColumn(0, Qt.AscendingOrder)
+        for column in range(1, 4):
+            self.tree.resizeColumnToContents(column)
+        self.label.setText(_("%d files changed, %d lines executed before, "
+                             "%d after") % (len(delta), executed[0],
+                                            executed[1]))
+
+    def item_lines(self, item):
+        """
+        Return the lines of the file of ``item`` that gained and lost
+        coverage, and its statements (see ``coveragestore.line_delta``)
+        """
+        if item.lines is None:
+            item.lines = line_delta(item.fdelta)
+        return item.lines
+
+    def expand_lines(self, item):
+        """ Show the lines of the expanded file that changed coverage """
+        if item.parent() is not None or item.childCount():
+            return
+        path = item.location[0]
+        gained, lost, statements = self.item_lines(item)
+        for text, lines in ((_("Gained"), gained), (_("Lost"), lost)):
+            for start, end in line_ranges(statements, lines):
+                child = QTreeWidgetItem(item, [text + ' ' +
+                                               format_range(start, end)])
+                child.location = (path, start)
+        if not item.childCount():
+            item.setChildIndicatorPolicy(
+                QTreeWidgetItem.DontShowIndicatorWhenChildless)
+
+    def activated(self, item, _column):
+        """ Open the file or lines of ``item`` in the editor """
+        path, line = item.location
+        if line is None:
+            # A file: its first line that changed coverage
+            gained, lost, _statements = self.item_lines(item)
+            line = (lost or gained or [1])[0]
+        self.emit(SIGNAL("edit_goto(QString,int,QString)"), path, line, '')
+
+
+class ScopeDialog(QDialog):
+    """
+    Edits the measurement scope of a project: the packages or directories
+    measured (the project root if none) and the file patterns omitted.
+    """
+    def __init__(self, parent, root, scope):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle(_("Measurement scope"))
+        self.source_edit = QLineEdit(', '.join(scope['source']), self)
+        self.source_edit.setPlaceholderText(root)
+        self.omit_edit = QLineEdit(', '.join(scope['omit']), self)
+        self.omit_edit.setPlaceholderText('*/tests/*, */migrations/*')
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok
+                                   | QDialogButtonBox.Cancel, parent=self)
+        self.connect(buttons, SIGNAL("accepted()"), self.accept)
+        self.connect(buttons, SIGNAL("rejected()"), self.reject)
+        layout = QFormLayout()
+        layout.addRow(_("Project:"), QLabel(root))
+        layout.addRow(_("Measured packages or directories:"),
+                      self.source_edit)
+        layout.addRow(_("Omitted file patterns:"), self.omit_edit)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+
+    def get_scope(self):
+        """Return the edited scope"""
+        return {'source': split_list(to_text_string(self.source_edit.text())),
+                'omit': split_list(to_text_string(self.omit_edit.text()))}
+
+
+class CoverageGutter(QWidget):
+    """
+    Strip painted over the right edge of the line number area of a code
+    editor, marking executed, missing and partial lines.
+
+    Only the visible lines are painted, and edits shift the markers (the
+    edited lines lose theirs) until the next analysis.
+    """
+    WIDTH = 4
+    COLORS = {EXECUTED: QColor('#57b557'), MISSING: QColor('#e05555'),
+              PARTIAL: QColor('#e8b030')}
+
+    def __init__(self, editor, filename):
+        QWidget.__init__(self, editor.linenumberarea)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.editor = editor
+        self.filename = filename
+        self.markers = None
+        document = editor.document()
+        self.revision = document.revision()
+        self.block_count = document.blockCount()
+        self.connect(editor, SIGNAL("updateRequest(QRect,int)"),
+                     self.editor_updated)
+        self.connect(document, SIGNAL("contentsChange(int,int,int)"),
+                     self.document_changed)
+        self.show()
+
+    def set_markers(self, markers):
+        """Set the ``LineMarkers`` to show, None to show nothing"""
+        self.markers = markers
+        self.update()
+
+    def editor_updated(self, _rect, _dy):
+        """Follow the line number area geometry and the scrolling"""
+        area = self.parentWidget()
+        self.setGeometry(area.width() - self.WIDTH, 0, self.WIDTH,
+                         area.height())
+        self.update()
+
+    def document_changed(self, position, _removed, _added):
+        """Shift the markers after an edit"""
+        document = self.editor.document()
+        revision, block_count = document.revision(), document.blockCount()
+        if revision == self.revision:
+            # Formatting change (syntax highlighting)
+            return
+        delta = block_count - self.block_count
+        self.revision, self.block_count = revision, block_count
+        if self.markers is None:
+            return
+        line = document.findBlock(position).blockNumber() + 1
+        self.markers.edit(line, 1 + max(0, -delta), 1 + max(0, delta))
+        self.update()
+
+    def paintEvent(self, event):
+        """Paint the markers of the visible lines"""
+        if not self.markers:
+            return
+        editor = self.editor
+        bottom = event.rect().bottom()
+        block = editor.firstVisibleBlock()
+        first = block.blockNumber() + 1
+        offset = editor.contentOffset()
+        tops = []
+        while block.isValid():
+            geometry = editor.blockBoundingGeometry(block).translated(offset)
+            if geometry.top() > bottom:
+                break
+            tops.append(geometry.top())
+            bottom_line = geometry.bottom()
+            block = block.next()
+        if not tops:
+            return
+        tops.append(bottom_line)
+        painter = QPainter(self)
+        for start, end, kind in self.markers.runs(first,
+                                                  first + len(tops) - 2):
+            top = tops[start - first]
+            painter.fillRect(0, int(top), self.WIDTH,
+                             int(tops[end - first + 1] - top),
+                             self.COLORS[kind])
+
+
+class CoverageOverlay(QObject):
+    """
+    Markers of the shown results in the gutter of the code editors.
+
+    Editors are attached with ``attach``; the markers of a file are shown
+    only if the editor and the file on disk are as they were analyzed.
+    """
+    def __init__(self, parent):
+        QObject.__init__(self, parent)
+        self.data = None
+        self.markers = {}
+        self.gutters = {}
+
+    def set_results(self, data):
+        """Show the results of ``data``, or nothing if None"""
+        self.data = data
+        self.markers = {}
+        for gutter in self.gutters.values():
+            gutter.set_markers(self.get_markers(gutter))
+
+    def get_markers(self, gutter):
+        """Return the markers of the file of ``gutter`` (None if outdated)"""
+        filename = gutter.filename
+        if self.data is None or filename not in self.data['files']:
+            return None
+        fprint = self.data['sources'].get(filename)
+        if fprint is None or has_changed(filename, fprint) \
+           or gutter.editor.document().isModified():
+            return None
+        if filename not in self.markers:
+            self.markers[filename] = LineMarkers.from_file_data(
+                                            self.data['files'][filename])
+        return self.markers[filename].copy()
+
+    def attach(self, editor, filename):
+        """Show the markers of ``filename`` in ``editor``"""
+        if editor is None or not filename \
+           or getattr(editor, 'linenumberarea', None) is None:
+            return
+        filename = osp.abspath(to_text_string(filename))
+        key = id(editor)
+        gutter = self.gutters.get(key)
+        if gutter is not None and gutter.filename == filename:
+            return
+        if gutter is None:
+            gutter = CoverageGutter(editor, filename)
+            self.gutters[key] = gutter
+            self.connect(gutter, SIGNAL("destroyed()"),
+                         lambda: self.gutters.pop(key, None))
+        gutter.filename = filename
+        gutter.set_markers(self.get_markers(gutter))
 
 
 class CoverageWidget(QWidget):
@@ -131,30 +1515,68 @@ class CoverageWidget(QWidget):
     """
     DATAPATH = get_conf_path('coverage.results')
     print(DATAPATH)
-    VERSION = '1.1.0'
+    # HTML reports, one directory per analyzed file (the data of the runs is
+    # next to DATAPATH, see ``data_cache_path``)
+    HTMLPATH = get_conf_path('coverage.html')
+    VERSION = VERSION
+    # Number of finished analyses kept in the list of analyses
+    MAX_FINISHED_JOBS = 10
+    # Delay (ms) between the last save of a source file and the re-run
+    RERUN_DELAY = 500
 
     def __init__(self, parent, max_entries=100):
         QWidget.__init__(self, parent)
 
         self.setWindowTitle("Coverage")
 
-        self.output = None
-        self.error_output = None
-
-        self.max_entries = max_entries
-        self.rdata = []
-        if osp.isfile(self.DATAPATH):
-            try:
-                data = pickle.loads(open(self.DATAPATH, 'rb').read())
-                if data[0] == self.VERSION:
-                    self.rdata = data[1:]
-            except (EOFError, ImportError):
-                pass
-
+        # Reuse the stored results if no measured source file changed
+        self.use_cache = True
+        # Number of processes the test suites of packages are split into
+        self.shard_count = multiprocessing.cpu_count()
+        # Only re-run the tests impacted by the changes made to a package
+        self.test_impact = True
+        # Number of analyses run at the same time, the others being queued
+        self.max_jobs = 2
+        # Measurement settings (see ``coverageworker.create_coverage``)
+        self.measure_settings = {}
+        # Only measure the project of the analyzed file (see ``get_scope``)
+        self.project_scope = True
+        # Update an HTML report in the background after each analysis
+        self.html_report = False
+        # Running HTML report processes, and the reports to update once
+        # they are finished, by analyzed file
+        self.html_processes = {}
+        self.html_pending = {}
+        # HTML reports to open once they are updated
+        self.html_open = set()
+        # Data files of the runs (see ``DataCache``), kept if ``keep_data``
+        self.data_cache = DataCache(data_cache_path(self.DATAPATH))
+        self.keep_data = True
+        # Function executing a line of code in a console of Spyder, in which
+        # the files are analyzed if set and if there is a console (see
+        # ``AnalysisJob.start_console``)
+        self.console_execute = None
+        # Re-run the analysis when one of its source files is saved
+        self.rerun_on_save = False
+        self.watcher = QFileSystemWatcher(self)
+        self.connect(self.watcher, SIGNAL("fileChanged(QString)"),
+                     self.source_saved)
+        self.rerun_timer = QTimer(self)
+        self.rerun_timer.setSingleShot(True)
+        self.rerun_timer.setInterval(self.RERUN_DELAY)
+        self.connect(self.rerun_timer, SIGNAL("timeout()"), self.rerun)
+
+        # Queued, running and last finished analyses (``AnalysisJob``)
+        self.jobs = []
+        self.log_dialog = None
+        self.delta_dialog = None
+
+        self.store = ResultsStore(self.DATAPATH, self.VERSION, max_entries)
+
+        # The history entries are added to the combo box by the validator
         self.filecombo = PythonModulesComboBox(self)
-        if self.rdata:
-            self.remove_obsolete_items()
-            self.filecombo.addItems(self.get_filenames())
+        self.validator = None
+        self.remove_obsolete_items()
 
         self.start_button = create_toolbutton(self,
                                               icon=get_icon('run.png'),
@@ -165,8 +1587,11 @@ class CoverageWidget(QWidget):
         self.stop_button = create_toolbutton(self,
                                              icon=get_icon('stop.png'),
                                              text=_("Stop"),
-                                             tip=_("Stop current analysis"),
+                                             tip=_("Stop the analysis of "
+                                                   "the selected file"),
                                              text_beside_icon=True)
+        self.connect(self.stop_button, SIGNAL("clicked()"),
+                     self.kill_if_running)
         self.connect(self.filecombo, SIGNAL('valid(bool)'),
                      self.start_button.setEnabled)
         self.connect(self.filecombo, SIGNAL('valid(bool)'), self.show_data)
@@ -178,18 +1603,56 @@ class CoverageWidget(QWidget):
 
         self.ratelabel = QLabel()
         self.datelabel = QLabel()
+        self.timelabel = QLabel()
+        self.progressbar = QProgressBar()
+        self.progressbar.setFormat(_("%v/%m shards"))
+        self.progressbar.hide()
         self.log_button = create_toolbutton(self,
                                             icon=get_icon('log.png'),
                                             text=_("Output"),
                                             text_beside_icon=True,
                                             tip=_("Complete output"),
                                             triggered=self.show_log)
-#        self.treewidget = ResultsTree(self)
+        self.log_button.setEnabled(False)
+        self.compare_menu = QMenu(self)
+        self.connect(self.compare_menu, SIGNAL("aboutToShow()"),
+                     self.update_compare_menu)
+        self.compare_button = create_toolbutton(self,
+                                                icon=get_icon('history.png'),
+                                                text=_("Compare"),
+                                                text_beside_icon=True,
+                                                tip=_("Compare with a "
+                                                      "previous run"))
+        self.compare_button.setPopupMode(self.compare_button.InstantPopup)
+        self.compare_button.setMenu(self.compare_menu)
+        self.html_button = create_toolbutton(self,
+                                             icon=get_icon('browser.png'),
+                                             text=_("HTML"),
+                                             text_beside_icon=True,
+                                             tip=_("Open the HTML report"),
+                                             triggered=self.open_html)
+        self.html_button.setEnabled(False)
+        self.scope_button = create_toolbutton(self,
+                                              icon=get_icon('filter.png'),
+                                              tip=_("Measurement scope of "
+                                                    "the project"),
+                                              triggered=self.edit_scope)
         self.resultswidget = ResultsWindow(self)
+        self.connect(self.resultswidget,
+                     SIGNAL("edit_goto(QString,int,QString)"),
+                     lambda fname, lineno, word:
+                     self.emit(SIGNAL("edit_goto(QString,int,QString)"),
+                               fname, lineno, word))
+        self.jobswidget = JobsWindow(self)
+        self.connect(self.jobswidget, SIGNAL("job_selected(QString)"),
+                     self.select_job_file)
+        self.connect(self.jobswidget, SIGNAL("clear_finished()"),
+                     lambda: self.prune_jobs(0))
 
         hlayout1 = QHBoxLayout()
         hlayout1.addWidget(self.filecombo)
         hlayout1.addWidget(browse_button)
+        hlayout1.addWidget(self.scope_button)
         hlayout1.addWidget(self.start_button)
         hlayout1.addWidget(self.stop_button)
 
@@ -197,32 +1660,30 @@ class CoverageWidget(QWidget):
         hlayout2.addWidget(self.ratelabel)
         hlayout2.addStretch()
         hlayout2.addWidget(self.datelabel)
+        hlayout2.addWidget(self.timelabel)
+        hlayout2.addWidget(self.progressbar)
         hlayout2.addStretch()
+        hlayout2.addWidget(self.compare_button)
+        hlayout2.addWidget(self.html_button)
         hlayout2.addWidget(self.log_button)
 
         layout = QVBoxLayout()
         layout.addLayout(hlayout1)
         layout.addLayout(hlayout2)
+        layout.addWidget(self.jobswidget)
         layout.addWidget(self.resultswidget)
         self.setLayout(layout)
 
-        self.process = None
-        self.set_running_state(False)
+        self.server = None
+        self.update_running_state()
 
-        if COVERAGE_PATH is None:
+        if get_coverage_path() is None:
             for widget in (self.resultswidget, self.filecombo,
                            self.start_button, self.stop_button):
                 widget.setDisabled(True)
-            if os.name == 'nt' \
-               and programs.is_module_installed("coverage"):
-                # Pylint is installed but pylint script is not in PATH
-                # (AFAIK, could happen only on Windows)
-                text = _('Coverage script was not found. Please add "%s" to PATH.')
-                text = to_text_string(text) % osp.join(sys.prefix, "Scripts")
-            else:
-                text = _('Please install <b>coverage</b>:')
-                url = 'https://pypi.python.org/pypi/coverage'
-                text += ' <a href=%s>%s</a>' % (url, url)
+            text = _('Please install <b>coverage</b>:')
+            url = 'https://pypi.python.org/pypi/coverage'
+            text += ' <a href=%s>%s</a>' % (url, url)
             self.ratelabel.setText(text)
         else:
             self.show_data()
@@ -230,21 +1691,72 @@ class CoverageWidget(QWidget):
     def analyze(self, filename):
         """
         Run coverage analysis on the active file.
+
+        If ``self.use_cache`` is set and none of the source files measured by
+        the previous analysis of this file changed, the stored results are
+        shown instead.
         """
-        if COVERAGE_PATH is None:
+        if get_coverage_path() is None:
             return
+        register_dependency()
         filename = to_text_string(filename)    # filename is a QString instance
         print(filename)
-        self.kill_if_running()
-        index, _data = self.get_data(filename)
-        if index is None:
+        data = self.get_data(filename)
+        self.select_job_file(filename)
+        if not self.filecombo.is_valid():
+            return
+        if self.use_cache \
+           and is_up_to_date(data, self.get_settings(filename), filename):
+            # The Analyze button always runs: it is the way to force a run
+            self.ratelabel.setText(_('No source file changed since the '
+                                     'last analysis'))
+            return
+        self.start()
+
+    def get_project_root(self, filename):
+        """ Returns the root directory of the project of ``filename`` """
+        return find_project_root(filename)
+
+    def get_scope(self, filename):
+        """
+        Returns the measurement scope of the project of ``filename``: its
+        stored scope, or by default the whole project
+        """
+        root = self.get_project_root(filename)
+        return root, get_scope(self.store, root)
+
+    def get_settings(self, filename):
+        """
+        Returns the measurement settings of an analysis of ``filename``:
+        the settings of the plugin, restricted to the scope of the project
+        (by default, the files under its root) if no source is set
+        """
+        if not self.project_scope or self.measure_settings.get('source'):
+            return analysis_settings(self.measure_settings)
+        root, scope = self.get_scope(filename)
+        return analysis_settings(self.measure_settings, root, scope)
+
+    def edit_scope(self):
+        """ Edits the measurement scope of the project of the current file """
+        filename = to_text_string(self.filecombo.currentText())
+        if not filename:
+            return
+        root, scope = self.get_scope(filename)
+        dialog = ScopeDialog(self, root, scope)
+        if dialog.exec_():
+            scope = dialog.get_scope()
+            self.store.set_scope(root, scope if any(scope.values()) else None)
+
+    def select_job_file(self, filename):
+        """ Select ``filename`` in the file combo box """
+        filename = to_text_string(filename)
+        index = self.filecombo.findText(filename)
+        if index == -1:
             self.filecombo.addItem(filename)
             self.filecombo.setCurrentIndex(self.filecombo.count()-1)
         else:
-            self.filecombo.setCurrentIndex(self.filecombo.findText(filename))
+            self.filecombo.setCurrentIndex(index)
         self.filecombo.selected()
-        if self.filecombo.is_valid():
-            self.start()
 
     def select_file(self):
         """ Select the file to run """
@@ -258,88 +1770,185 @@ class CoverageWidget(QWidget):
             self.analyze(filename)
 
     def remove_obsolete_items(self):
-        """ Remove obsolete items from the data log"""
-        self.rdata = [(filename, data) for filename, data in self.rdata
-                      if is_module_or_package(filename)]
+        """
+        Remove obsolete items from the data log.
+
+        The files are checked in a background thread, the valid ones being
+        added to the file combo box as they are checked.
+        """
+        if self.validator is not None and self.validator.isRunning():
+            return
+        self.validator = HistoryValidator(self, self.get_filenames())
+        self.connect(self.validator,
+                     SIGNAL("validated(PyQt_PyObject,PyQt_PyObject)"),
+                     self.add_validated_items)
+        self.validator.start()
+
+    def add_validated_items(self, valid, obsolete):
+        """ Update the file combo box with a batch of checked items """
+        self.store.remove(obsolete)
+        for filename in obsolete:
+            index = self.filecombo.findText(filename)
+            if index != -1:
+                self.filecombo.removeItem(index)
+        for filename in valid:
+            if self.filecombo.findText(filename) == -1:
+                self.filecombo.addItem(filename)
 
     def get_filenames(self):
         """ Get filenames that are in the data log """
-        return [filename for filename, _data in self.rdata]
+        return self.store.filenames()
 
     def get_data(self, filename):
         """ Get data from the data log """
-        filename = osp.abspath(filename)
-        for index, (fname, data) in enumerate(self.rdata):
-            if fname == filename:
-                return index, data
-        else:
-            return None, None
+        return self.store.get(osp.abspath(filename))
 
     def set_data(self, filename, data):
         """ Set data in the data log """
-        filename = osp.abspath(filename)
-        index, _data = self.get_data(filename)
-        if index is not None:
-            self.rdata.pop(index)
-        self.rdata.insert(0, (filename, data))
-        self.save()
-
-    def save(self):
-        """ Save data to the data log """
-        while len(self.rdata) > self.max_entries:
-            self.rdata.pop(-1)
-        pickle.dump([self.VERSION]+self.rdata, open(self.DATAPATH, 'wb'), 2)
-
-    def show_log(self):
-        print("Show Log was clicked! Doesn't do anything yet...")
-        pass
-#        if self.output:
-#            TextEditor(self.output, title=_("Pylint output"),
-#                       readonly=True, size=(700, 500)).exec_()
+        self.store.set(osp.abspath(filename), data)
 
-    def run_report(self, filename):
+    def set_worker_server(self, enabled, preload=''):
         """
-        Run the coverage reporting for the file.
-
-        Calls ``coverage report`` as a separate thread.
-
-        Redirects all output to ``self.read_output()`` method.
+        Enable or disable the warm worker (see ``CoverageServer``).
 
-        Upon finish, calls the ``self.finished`` method.
+        ``preload`` is a comma-separated list of modules the worker imports
+        once for all at startup.
+        """
+        enabled = enabled and CoverageServer.is_supported()
+        if self.server is not None:
+            if enabled and preload == self.server.preload:
+                return
+            for job in self.jobs:
+                if job.server is self.server:
+                    job.cancel()
+            self.server.shutdown()
+            self.server = None
+        if enabled:
+            self.server = CoverageServer(self, preload)
+
+    def set_rerun_on_save(self, enabled):
+        """ Enable or disable the re-run of the analysis on save """
+        self.rerun_on_save = enabled
+        self.watch_sources()
+
+    def watch_sources(self, data=None):
+        """
+        Watch the source files measured by the shown analysis (``data``),
+        if re-running on save
         """
+        files = self.watcher.files()
+        if files:
+            self.watcher.removePaths(files)
+        self.rerun_timer.stop()
+        if self.rerun_on_save and data is None:
+            filename = to_text_string(self.filecombo.currentText())
+            data = self.get_data(filename) if filename else None
+        if self.rerun_on_save and data is not None:
+            sources = [path for path in data['sources'] if osp.isfile(path)]
+            if sources:
+                self.watcher.addPaths(sources)
+
+    def source_saved(self, path):
+        """
+        Schedules a new analysis: saves less than ``RERUN_DELAY`` ms apart
+        cause a single run
+        """
+        path = to_text_string(path)
+        if osp.isfile(path) and path not in self.watcher.files():
+            # Saved by replacing the file: it is no longer watched
+            self.watcher.addPath(path)
+        self.rerun_timer.start()
 
-        self.process = QProcess(self)
-        self.process.setProcessChannelMode(QProcess.SeparateChannels)
-        self.process.setWorkingDirectory(osp.dirname(filename))
-        self.connect(self.process, SIGNAL("readyReadStandardOutput()"),
-                     self.read_output)
-        self.connect(self.process, SIGNAL("readyReadStandardError()"),
-                     lambda: self.read_output(error=True))
-        self.connect(self.process,
-                     SIGNAL("finished(int,QProcess::ExitStatus)"),
-                     self.finished)
-        self.connect(self.stop_button, SIGNAL("clicked()"),
-                     self.process.kill)
+    def rerun(self):
+        """
+        Re-runs the analysis after a source file was saved, if a source file
+        changed: the new analysis replaces the running one, which is
+        outdated (see ``start``). A save without changes leaves the running
+        analysis alone.
+        """
+        filename = to_text_string(self.filecombo.currentText())
+        data = self.get_data(filename) if filename else None
+        if not self.rerun_on_save or data is None \
+           or not self.filecombo.is_valid():
+            return
+        if self.use_cache \
+           and is_up_to_date(data, self.get_settings(filename), filename):
+            return
+        self.start()
 
-        # start the process which runs the reporting function.
-        p_args = ['report', '-m']
-        self.process.start(COVERAGE_PATH, p_args)
+    def current_job(self):
+        """ Returns the last analysis of the selected file, None if none """
+        filename = to_text_string(self.filecombo.currentText())
+        for job in reversed(self.jobs):
+            if job.filename == filename:
+                return job
 
-        running = self.process.waitForStarted()
-        self.set_running_state(running)
-        if not running:
-            QMessageBox.critical(self, _("Error"),
-                                 _("Process failed to start"))
+    def show_log(self):
+        """
+        Shows the output of the last analysis of the selected file, updated
+        as it comes, and the report of the shown results
+        """
+        if self.log_dialog is None:
+            self.log_dialog = OutputLog(self)
+        job = self.current_job()
+        text = job.output.text() if job is not None else ''
+        results = self.resultswidget.results
+        if results is not None:
+            basedir = osp.dirname(osp.abspath(self.resultswidget.filename))
+            branch = any('missing_arcs' in fdata for fdata in results.values())
+            if text and not text.endswith('\n'):
+                text += '\n'
+            text += format_report(dict(files=results, branch=branch), basedir)
+        self.log_dialog.set_text(text)
+        self.log_dialog.show()
+        self.log_dialog.raise_()
+
+    def update_compare_menu(self):
+        """ Lists the previous runs of the current file """
+        self.compare_menu.clear()
+        filename = osp.abspath(to_text_string(self.filecombo.currentText()))
+        runs = self.store.runs(filename)
+        for run_id, date in runs:
+            action = self.compare_menu.addAction(
+                to_text_string(time.strftime("%d %b %Y %H:%M", date),
+                               encoding='utf8'))
+            self.connect(action, SIGNAL("triggered()"),
+                         lambda run_id=run_id, date=date:
+                         self.show_delta(filename, run_id, date))
+        if not runs:
+            self.compare_menu.addAction(_("No previous run")).setEnabled(False)
+
+    def show_delta(self, filename, run_id, date):
+        """ Shows the changes of coverage since the run ``run_id`` """
+        delta = self.store.compare(filename, run_id)
+        if delta is None:
+            return
+        if self.delta_dialog is None:
+            self.delta_dialog = DeltaWindow(self)
+            self.connect(self.delta_dialog,
+                         SIGNAL("edit_goto(QString,int,QString)"),
+                         lambda fname, lineno, word:
+                         self.emit(SIGNAL("edit_goto(QString,int,QString)"),
+                                   fname, lineno, word))
+        self.delta_dialog.set_delta(delta, osp.dirname(filename), date)
+        self.delta_dialog.show()
+        self.delta_dialog.raise_()
+
+    def job_output(self, job, text):
+        """ Shows the output of ``job`` if its file is selected """
+        if job is self.current_job():
+            self.log_button.setEnabled(True)
+            if self.log_dialog is not None and self.log_dialog.isVisible():
+                self.log_dialog.append(to_text_string(text))
 
     def start(self):
         """
-        Run coverage analisys.
-
-        Calls ``coverage run <filepath>`` as a seperate thread.
-
-        Redirects all standard output to the ``self.read_output()`` method.
+        Queues an analysis of the selected file, replacing the queued or
+        running one of this file if any.
 
-        Upon finished signal, calls run_report().
+        Up to ``self.max_jobs`` analyses run at the same time (see
+        ``AnalysisJob``). Upon finish, calls the ``self.job_finished``
+        method.
         """
         filename = to_text_string(self.filecombo.currentText())
 
@@ -348,109 +1957,319 @@ class CoverageWidget(QWidget):
         if osp.basename(filename) == "coveragegui.py":
             filename = osp.join(osp.split(filename)[0], "__init__.py")
 
-        self.process = QProcess(self)
-        self.process.setProcessChannelMode(QProcess.SeparateChannels)
-        self.process.setWorkingDirectory(osp.dirname(filename))
-#        self.connect(self.process, SIGNAL("readyReadStandardOutput()"),
-#                     self.read_output)
-        self.connect(self.process, SIGNAL("readyReadStandardError()"),
-                     lambda: self.read_output(error=True))
-        self.connect(self.process,
-                     SIGNAL("finished(int,QProcess::ExitStatus)"),
-                     lambda: self.run_report(filename))
-        self.connect(self.stop_button, SIGNAL("clicked()"),
-                     self.process.kill)
-
-        self.output = ''
-        self.error_output = ''
+        for job in self.jobs:
+            if job.filename == filename:
+                job.cancel()
+
+        save_data = None
+        if self.keep_data or self.html_report:
+            # Each run has its own data file
+            save_data = self.data_cache.new_file(filename)
+        job = AnalysisJob(self, filename, self.get_settings(filename),
+                          save_data)
+        self.connect(job, SIGNAL("output(QString)"),
+                     lambda text: self.job_output(job, text))
+        self.connect(job, SIGNAL("status_changed()"),
+                     lambda: self.job_status_changed(job))
+        self.connect(job, SIGNAL("finished()"),
+                     lambda: self.job_finished(job))
+        self.jobs.append(job)
+        self.jobswidget.add_job(job)
+        self.prune_jobs()
+        if self.log_dialog is not None and self.log_dialog.isVisible():
+            self.log_dialog.set_text('')
+        self.schedule()
+        self.update_running_state()
+
+    def schedule(self):
+        """ Starts queued analyses, up to ``self.max_jobs`` running ones """
+        running = len([job for job in self.jobs
+                       if job.status == AnalysisJob.RUNNING])
+        # A console runs one analysis at a time
+        console_busy = any(job.console_timer is not None
+                           and job.status == AnalysisJob.RUNNING
+                           for job in self.jobs)
+        for job in self.jobs:
+            if running >= self.max_jobs:
+                break
+            if job.status == AnalysisJob.QUEUED:
+                if self.in_console(job.filename):
+                    if console_busy:
+                        continue
+                    console_busy = True
+                self.start_job(job)
+                running += 1
+
+    def in_console(self, filename):
+        """ Returns True if ``filename`` is analyzed in a console """
+        return self.console_execute is not None and not osp.isdir(filename)
+
+    def start_job(self, job):
+        """
+        Starts ``job``: the test suite of a package is run in
+        ``self.shard_count`` processes, a file in a console or in the warm
+        worker if enabled, or else in a worker process
+        """
+        filename = job.filename
+        if osp.isdir(filename):
+            modules = find_test_modules(filename)
+            if modules:
+                selection = None
+                if self.test_impact and not impact_available(job.settings):
+                    job.append_output(_("Branch coverage is measured: the "
+                                        "whole test suite runs, without test "
+                                        "impact analysis") + '\n')
+                elif self.test_impact:
+                    selection = test_selection(self.store, filename, modules,
+                                               job.settings)
+                if selection is not None:
+                    # Only the data of full runs is kept (and updates the
+                    # HTML report): that of the selected tests does not
+                    # cover the whole suite
+                    discard_results(job.save_data)
+                    job.save_data = None
+                job.start_sharded(modules, self.shard_count, selection)
+                return
+        if self.in_console(filename) \
+           and job.start_console(self.console_execute):
+            return
+        if self.server is not None:
+            job.start_server(self.server)
+        else:
+            job.start_process()
 
-        # start the process which runs the coverage analysis.
-        p_args = ['run', filename]
-        self.process.start(COVERAGE_PATH, p_args)
+    def prune_jobs(self, max_finished=None):
+        """
+        Removes the oldest finished analyses, keeping ``max_finished`` of
+        them (``MAX_FINISHED_JOBS`` by default)
+        """
+        if max_finished is None:
+            max_finished = self.MAX_FINISHED_JOBS
+        # A cancelled job whose processes are not dead yet still has to clean
+        # up
+        finished = [job for job in self.jobs
+                    if not job.is_active() and job.process is None
+                    and job.sharded is None and job.console_timer is None]
+        for job in finished[:max(0, len(finished) - max_finished)]:
+            self.jobs.remove(job)
+            self.jobswidget.remove_job(job)
+            job.deleteLater()
+        self.update_running_state()
+
+    def job_status_changed(self, job):
+        """ Shows the status of ``job`` """
+        self.jobswidget.update_job(job)
+        if job is self.current_job():
+            self.update_running_state()
+
+    def update_running_state(self):
+        """ Shows the state of the analysis of the selected file """
+        job = self.current_job()
+        running = job is not None and job.is_active()
+        self.stop_button.setEnabled(running)
+        if running and job.progress is not None:
+            self.progressbar.setRange(0, job.progress[1])
+            self.progressbar.setValue(job.progress[0])
+            self.progressbar.show()
+        else:
+            self.progressbar.hide()
+
+    def job_finished(self, job):
+        """ Processes the end of ``job``, storing its results """
+        self.schedule()
+        self.data_cache.evict()
+        self.update_running_state()
+        if job.status == AnalysisJob.FAILED:
+            if job.error_output:
+                error_output = job.error_output.text()
+                QMessageBox.critical(self, _("Error"),
+                                     job.filename + '\n\n' + error_output)
+                print("coverage error:\n\n" + error_output,
+                      file=sys.stderr)
+            return
+        if job.status != AnalysisJob.DONE:
+            return
 
-        running = self.process.waitForStarted()
-        self.set_running_state(running)
-        if not running:
-            QMessageBox.critical(self, _("Error"),
-                                 _("Process failed to start"))
+        results = job.results
+        start = time.time()
+        if job.impact is not None:
+            results = update_test_index(self.store, job.impact, results)
+            job.timings.append(('impact', time.time() - start))
+            start = time.time()
+        # Storing and showing the results are not timed in the history
+        store_results(self.store, job.filename, results, job.settings,
+                      job.timings, job.impact[1] if job.impact else None)
+        if job.save_data is not None and self.html_report:
+            self.update_html(job.filename, job.settings)
+        timings = job.timings + [('store', time.time() - start)]
+        if job is self.current_job():
+            start = time.time()
+            self.show_data(justanalyzed=True)
+            self.show_timings(timings + [('render', time.time() - start)])
+
+    def update_html(self, filename, settings):
+        """
+        Updates the HTML report of ``filename`` from the data of its latest
+        run, in a background process: coverage only rewrites the pages of the
+        files whose data or source changed since the last update
+        """
+        if filename in self.html_processes:
+            # Updated again once the running update is finished
+            self.html_pending[filename] = settings
+            return
+        data_file = self.data_cache.latest(filename)
+        if data_file is None:
+            return
+        directory = html_directory(self.HTMLPATH, filename)
+        process = QProcess(self)
+        process.setProcessChannelMode(QProcess.MergedChannels)
+        process.setWorkingDirectory(osp.dirname(osp.abspath(filename)))
+        self.connect(process, SIGNAL("finished(int,QProcess::ExitStatus)"),
+                     lambda: self.html_finished(filename))
+        self.html_processes[filename] = process
+        p_args = [WORKER_PATH, '--html', directory, '--data-file', data_file]
+        process.start(get_python_executable(),
+                      p_args + settings_args(settings) + [filename])
+
+    def html_finished(self, filename):
+        """ The HTML report of ``filename`` is updated """
+        process = self.html_processes.pop(filename)
+        failed = process.exitCode() != 0
+        if failed:
+            output = locale_codec.toUnicode(process.readAllStandardOutput())
+            print("coverage HTML report error:\n\n" + to_text_string(output),
+                  file=sys.stderr)
+        process.deleteLater()
+        if filename in self.html_pending:
+            self.update_html(filename, self.html_pending.pop(filename))
+        elif filename in self.html_open:
+            self.html_open.discard(filename)
+            if not failed:
+                programs.start_file(self.html_index(filename))
+        self.update_html_button()
+
+    def html_index(self, filename):
+        """ Returns the index page of the HTML report of ``filename`` """
+        return osp.join(html_directory(self.HTMLPATH, filename), 'index.html')
+
+    def html_outdated(self, filename):
+        """
+        Returns True if the HTML report of ``filename`` is older than the data
+        of its latest run
+        """
+        data_file = self.data_cache.latest(filename)
+        index = self.html_index(filename)
+        return data_file is not None and (not osp.isfile(index) or
+               os.stat(index).st_mtime < os.stat(data_file).st_mtime)
 
-    def set_running_state(self, state=True):
-        """ Sets the running state """
-        self.start_button.setEnabled(not state)
-        self.stop_button.setEnabled(state)
+    def update_html_button(self):
+        """
+        Enables the HTML button if the selected file has a report, or the
+        data to generate it
+        """
+        filename = to_text_string(self.filecombo.currentText())
+        self.html_button.setEnabled(bool(filename) and
+                                    (osp.isfile(self.html_index(filename))
+                                     or self.data_cache.latest(filename)
+                                     is not None))
 
-    def read_output(self, error=False):
+    def open_html(self):
         """
-        Reads the output, both standard and error, to instance attributes
+        Opens the HTML report of the selected file, once generated from the
+        kept data of its latest run if outdated
         """
-        if error:
-            self.process.setReadChannel(QProcess.StandardError)
-        else:
-            self.process.setReadChannel(QProcess.StandardOutput)
+        filename = to_text_string(self.filecombo.currentText())
+        if not filename:
+            return
+        if filename in self.html_processes or self.html_outdated(filename):
+            self.html_open.add(filename)
+            if filename not in self.html_processes:
+                data = self.get_data(filename) or {}
+                self.update_html(filename, data.get('settings'))
+            return
+        programs.start_file(self.html_index(filename))
 
-        qba = QByteArray()
-        while self.process.bytesAvailable():
-            if error:
-                qba += self.process.readAllStandardError()
-            else:
-                qba += self.process.readAllStandardOutput()
-        text = to_text_string(locale_codec.toUnicode(qba.data()))
-        if error:
-            self.error_output += text
-        else:
-            self.output += text
+    def score_text(self):
+        """ Returns the overall coverage of the shown results, as text """
+        rollups = self.resultswidget.model.rollups
+        return _("Covered: <b>%d%%</b>") % counts_percent(rollups.total)
 
-    def finished(self):
-        """ Processes the finish state """
+    def worst_text(self, count=5):
+        """
+        Returns the ``count`` least covered directories of the shown results,
+        as text
+        """
+        rollups = self.resultswidget.model.rollups
+        basedir = self.resultswidget.model.root.path
+        worst = rollups.worst(count, basedir)
+        if not worst:
+            return ''
+        lines = [_("Least covered directories:")]
+        for directory, percent in worst:
+            name = osp.relpath(directory, basedir) if basedir else directory
+            lines.append('%d%%  %s' % (percent, name))
+        return '\n'.join(lines)
+
+    def show_timings(self, timings):
+        """ Shows where the time of the shown analysis was spent """
+        if timings:
+            self.timelabel.setText(format_timings(timings, compact=True))
+            self.timelabel.setToolTip(format_timings(timings))
+        else:
+            self.timelabel.setText('')
+            self.timelabel.setToolTip('')
 
-        self.set_running_state(False)
-        if not self.output:
-            if self.error_output:
-                QMessageBox.critical(self, _("Error"), self.error_output)
-                print("coverage error:\n\n" + self.error_output,
-                      file=sys.stderr)
-            return
+    def kill_if_running(self, all_jobs=False):
+        """
+        Cancels the analysis of the selected file, or all of them.
 
+        This does not wait for the processes to die (see
+        ``AnalysisJob.cancel``).
+        """
         filename = to_text_string(self.filecombo.currentText())
-        self.set_data(filename, (time.localtime(), self.output))
-        self.output = self.error_output + self.output
-        self.show_data(justanalyzed=True)
-
-    def kill_if_running(self):
-        """ Kills the process if it's running """
-        if self.process is not None:
-            if self.process.state() == QProcess.Running:
-                self.process.kill()
-                self.process.waitForFinished()
+        for job in self.jobs:
+            if all_jobs or job.filename == filename:
+                job.cancel()
+        if all_jobs:
+            self.html_pending.clear()
+            self.html_open.clear()
+            for process in self.html_processes.values():
+                process.kill()
 
     def show_data(self, justanalyzed=False):
         """ Shows the data """
-        if not justanalyzed:
-            self.output = None
-        self.log_button.setEnabled(self.output is not None
-                                   and len(self.output) > 0)
-        self.kill_if_running()
+        self.update_running_state()
+        self.log_button.setEnabled(self.current_job() is not None)
+        self.update_html_button()
         filename = to_text_string(self.filecombo.currentText())
         if not filename:
+            self.emit(SIGNAL("results_shown(PyQt_PyObject)"), None)
             return
 
-        _index, data = self.get_data(filename)
+        data = self.get_data(filename)
         if data is None:
             text = _('Source code has not been rated yet.')
             self.resultswidget.clear_results()
             date_text = ''
         else:
-            text = ''
-            datetime, results = data
+            datetime, results = data['date'], data['files']
             text_style = "<span style=\'color: #444444\'><b>%s </b></span>"
             self.resultswidget.set_results(filename, results)
+            text = self.score_text()
+            self.log_button.setEnabled(True)
             date = to_text_string(time.strftime("%d %b %Y %H:%M",
                                                 datetime),
                                   encoding='utf8')
             date_text = text_style % date
 
         self.ratelabel.setText(text)
+        self.ratelabel.setToolTip(self.worst_text() if data else '')
         self.datelabel.setText(date_text)
+        self.show_timings(data.get('timings', []) if data else [])
+        self.watch_sources(data)
+        if self.log_dialog is not None and self.log_dialog.isVisible():
+            self.show_log()
+        self.emit(SIGNAL("results_shown(PyQt_PyObject)"), data)
 
 
 def test():
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Test impact analysis
+
+After a test suite run, the coverage worker reports the lines executed by
+each test (one dynamic context per test). This module keeps that as an
+index, selects the tests whose lines were edited since, and merges the
+results of a run of those tests only with the cached data of the others.
+
+Changes to code executed outside of any test (module-level code run at
+import time) cannot be attributed to tests: they require a full run.
+"""
+
+# pylint: disable=C0103
+
+import difflib
+import os.path as osp
+
+from spyderplugins.widgets.coverageworker import (has_changed, line_hashes,
+                                                  module_name)
+
+INDEX_VERSION = 1
+
+
+def build_index(results, modules):
+    """
+    Return the test index of a test suite run: the lines executed by each
+    test and, for every measured file, its statements and line hashes.
+
+    ``modules`` are the test modules of the suite. Returns None if the
+    results have no per-test data.
+    """
+    if 'contexts' not in results or results.get('branch'):
+        return None
+    files = {}
+    for filename, fdata in results['files'].items():
+        files[filename] = {'statements': fdata['statements'],
+                           'excluded': fdata['excluded'],
+                           'hashes': results['hashes'][filename]}
+    return {'version': INDEX_VERSION,
+            'contexts': results['contexts'],
+            'files': files,
+            'modules': sorted(modules),
+            'sources': results['sources']}
+
+
+def diff_lines(old_hashes, new_hashes):
+    """
+    Compare two versions of a file, given as line hashes.
+
+    Returns the old lines that were modified or deleted, the old lines around
+    insertions and the mapping of the unchanged old lines to the new ones.
+    """
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes,
+                                      autojunk=False)
+    changed, neighbours, mapping = set(), set(), {}
+    for tag, i1, i2, j1, _j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                mapping[i1 + offset + 1] = j1 + offset + 1
+        elif tag == 'insert':
+            neighbours.update((i1, i1 + 1))
+        else:
+            changed.update(range(i1 + 1, i2 + 1))
+    return changed, neighbours, mapping
+
+
+def test_file(test_id, modules_by_name):
+    """
+    Return the module file of ``test_id``: a pytest node id starting with
+    the module path, or a unittest id starting with the module name.
+    """
+    if '::' in test_id:
+        return test_id.split('::')[0]
+    name = test_id
+    while '.' in name:
+        name = name.rsplit('.', 1)[0]
+        if name in modules_by_name:
+            return modules_by_name[name]
+
+
+class Selection(object):
+    """
+    Tests to re-run, as test module paths or test ids (``names``), and what
+    is needed to merge their results with the index: the contexts to drop
+    and the line mappings of the changed files (None for deleted files).
+    """
+    def __init__(self, names, dropped, mappings):
+        self.names = names
+        self.dropped = dropped
+        self.mappings = mappings
+
+    def changed_files(self):
+        """Return the changed files that still exist"""
+        return sorted(filename for filename, mapping in self.mappings.items()
+                      if mapping is not None)
+
+
+def select_tests(index, modules):
+    """
+    Return the ``Selection`` of the tests impacted by the changes made since
+    ``index`` was built, ``modules`` being the current test modules.
+
+    Returns None if a full run is needed.
+    """
+    if index is None or index.get('version') != INDEX_VERSION:
+        return None
+    modules = set(modules)
+    modules_by_name = dict((module_name(filename)[0], filename)
+                           for filename in modules | set(index['modules']))
+    rerun = modules - set(index['modules'])
+    affected = set()
+    mappings = {}
+    for filename, fprint in index['sources'].items():
+        if fprint is not None and not has_changed(filename, fprint):
+            continue
+        deleted = not osp.isfile(filename)
+        if deleted:
+            changed, neighbours, mappings[filename] = set(), set(), None
+        else:
+            old = index['files'].get(filename, {}).get('hashes', [])
+            changed, neighbours, mappings[filename] = \
+                diff_lines(old, line_hashes(filename))
+        if filename in index['modules']:
+            if not deleted:
+                rerun.add(filename)
+            continue
+        for context, files in index['contexts'].items():
+            lines = set(files.get(filename, []))
+            hit = lines if deleted else lines & changed
+            if not context:
+                if hit:
+                    return None
+            elif hit or lines & neighbours:
+                affected.add(context)
+
+    dropped = set(affected)
+    for context in index['contexts']:
+        if not context:
+            continue
+        filename = test_file(context, modules_by_name)
+        if filename is None:
+            return None
+        if filename in rerun or filename not in modules:
+            dropped.add(context)
+    names = sorted(rerun)
+    names += sorted(context for context in affected
+                    if test_file(context, modules_by_name) in modules - rerun)
+    return Selection(names, dropped, mappings)
+
+
+def merge(index, selection, results, modules):
+    """
+    Merge the ``results`` of a run of the ``selection`` with the cached
+    data of ``index``.
+
+    Returns the merged results and the updated index.
+    """
+    contexts = {}
+    for context, files in index['contexts'].items():
+        if context in selection.dropped:
+            continue
+        kept = {}
+        for filename, lines in files.items():
+            if filename in selection.mappings:
+                mapping = selection.mappings[filename] or {}
+                lines = [mapping[line] for line in lines if line in mapping]
+            if lines:
+                kept[filename] = lines
+        contexts[context] = kept
+    for context, files in results.get('contexts', {}).items():
+        if context:
+            contexts[context] = files
+            continue
+        kept = contexts.setdefault('', {})
+        for filename, lines in files.items():
+            kept[filename] = sorted(set(kept.get(filename, [])) | set(lines))
+
+    infos = dict((filename, info) for filename, info in index['files'].items()
+                 if selection.mappings.get(filename, True) is not None)
+    hashes = results.get('hashes', {})
+    for filename, fdata in results['files'].items():
+        infos[filename] = {'statements': fdata['statements'],
+                           'excluded': fdata['excluded'],
+                           'hashes': hashes.get(filename)
+                                     or line_hashes(filename)}
+
+    executed = {}
+    for files in contexts.values():
+        for filename, lines in files.items():
+            executed.setdefault(filename, set()).update(lines)
+    files = {}
+    for filename, info in infos.items():
+        statements = set(info['statements'])
+        lines = statements & executed.get(filename, set())
+        files[filename] = {'statements': info['statements'],
+                           'executed': sorted(lines),
+                           'missing': sorted(statements - lines),
+                           'excluded': info['excluded']}
+
+    sources = dict((filename, fprint)
+                   for filename, fprint in index['sources'].items()
+                   if filename in infos)
+    sources.update(results['sources'])
+    merged = dict(results, files=files, sources=sources, contexts=contexts,
+                  hashes=dict((filename, info['hashes'])
+                              for filename, info in infos.items()))
+    return merged, build_index(merged, modules)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Coverage line markers
+
+The executed, missing and partial lines of a file, kept as sorted runs of
+consecutive lines of the same kind: looking up the markers of the visible
+lines costs a bisection plus the runs found, whatever the size of the file,
+and edits shift the runs instead of invalidating the whole file.
+"""
+
+# pylint: disable=C0103
+
+from bisect import bisect_left
+
+EXECUTED, MISSING, PARTIAL = range(3)
+
+
+def line_kinds(fdata):
+    """
+    Return the marker kind of each statement of a file, given its results:
+    a dict mapping line numbers to ``EXECUTED``, ``MISSING`` or ``PARTIAL``
+    (executed with branches not taken).
+    """
+    kinds = dict((line, EXECUTED) for line in fdata['executed'])
+    kinds.update((line, MISSING) for line in fdata['missing'])
+    for start, end in fdata.get('missing_arcs', []):
+        if kinds.get(start) == EXECUTED and kinds.get(end) != MISSING:
+            kinds[start] = PARTIAL
+    return kinds
+
+
+class LineMarkers(object):
+    """
+    Markers of a file: ``starts``, ``ends`` and ``kinds`` describe runs of
+    lines ``starts[i]`` to ``ends[i]`` (inclusive) all of kind ``kinds[i]``.
+    Runs are sorted and do not overlap.
+    """
+    def __init__(self, kinds=None):
+        self.starts, self.ends, self.kinds = [], [], []
+        for line in sorted(kinds or {}):
+            kind = kinds[line]
+            if self.ends and self.ends[-1] == line - 1 \
+               and self.kinds[-1] == kind:
+                self.ends[-1] = line
+            else:
+                self.starts.append(line)
+                self.ends.append(line)
+                self.kinds.append(kind)
+
+    @classmethod
+    def from_file_data(cls, fdata):
+        """Return the markers of a file, given its results"""
+        return cls(line_kinds(fdata))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def copy(self):
+        """Return a copy of the markers"""
+        markers = LineMarkers()
+        markers.starts = list(self.starts)
+        markers.ends = list(self.ends)
+        markers.kinds = list(self.kinds)
+        return markers
+
+    def runs(self, first, last):
+        """
+        Generate the ``(start, end, kind)`` runs of lines ``first`` to
+        ``last``, clipped to these lines
+        """
+        index = bisect_left(self.ends, first)
+        while index < len(self.starts) and self.starts[index] <= last:
+            yield (max(first, self.starts[index]),
+                   min(last, self.ends[index]), self.kinds[index])
+            index += 1
+
+    def edit(self, line, old_count, new_count):
+        """
+        Update the markers after ``old_count`` lines starting at ``line``
+        were replaced by ``new_count`` lines: the markers of the replaced
+        lines are dropped, those of the following lines are shifted.
+        """
+        after = line + old_count
+        delta = new_count - old_count
+        index = bisect_left(self.ends, line)
+        starts, ends = self.starts[:index], self.ends[:index]
+        kinds = self.kinds[:index]
+        for start, end, kind in zip(self.starts[index:], self.ends[index:],
+                                    self.kinds[index:]):
+            if start < line:
+                starts.append(start)
+                ends.append(line - 1)
+                kinds.append(kind)
+            if end >= after:
+                starts.append(max(start, after) + delta)
+                ends.append(end + delta)
+                kinds.append(kind)
+        self.starts, self.ends, self.kinds = starts, ends, kinds
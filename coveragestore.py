@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Coverage results store
+
+History of the coverage results, one entry per analyzed file, kept in a
+SQLite database indexed by filename: saving an entry only writes that entry
+and looking one up does not scan the others.
+
+The line numbers of the results are stored as compressed run-length
+encoded arrays. The previous runs of each file are kept, so that runs can
+be compared, and so is the measurement scope of each project.
+"""
+
+# pylint: disable=C0103
+
+from __future__ import with_statement
+
+import os
+import os.path as osp
+import sqlite3
+import time
+import zlib
+from array import array
+
+try:
+    import cPickle as pickle  # Python 2
+except ImportError:
+    import pickle
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+# Seconds to wait for another process writing to the store (e.g. a batch
+# analysis running while Spyder is open)
+LOCK_TIMEOUT = 30
+
+# Per-file results holding lists of line numbers, and of arcs
+LINE_KEYS = ('statements', 'executed', 'missing', 'excluded')
+ARC_KEYS = ('arcs', 'missing_arcs')
+
+
+def _to_bytes(values):
+    """Return the bytes of an array of ints"""
+    values = array('i', values)
+    try:
+        return values.tobytes()
+    except AttributeError:
+        return values.tostring()  # Python 2
+
+
+def _from_bytes(data):
+    """Return the array of ints stored as ``data``"""
+    values = array('i')
+    try:
+        values.frombytes(data)
+    except AttributeError:
+        values.fromstring(data)  # Python 2
+    return values
+
+
+def pack_lines(lines):
+    """
+    Encode sorted line numbers as runs of consecutive lines:
+    ``[1, 2, 3, 7]`` is stored as ``1, 3, 7, 1`` (start, length)
+    """
+    runs = []
+    for line in lines:
+        if runs and runs[-2] + runs[-1] == line:
+            runs[-1] += 1
+        else:
+            runs += [line, 1]
+    return _to_bytes(runs)
+
+
+def unpack_lines(data):
+    """Decode line numbers encoded by ``pack_lines``"""
+    runs = _from_bytes(data)
+    lines = []
+    for index in range(0, len(runs), 2):
+        lines.extend(range(runs[index], runs[index] + runs[index + 1]))
+    return lines
+
+
+def count_lines(data):
+    """Return the number of line numbers encoded by ``pack_lines``"""
+    return sum(_from_bytes(data)[1::2])
+
+
+def pack_files(files):
+    """Return per-file results with their lists of lines encoded"""
+    packed = {}
+    for filename, fdata in files.items():
+        fdata = dict(fdata)
+        for key in LINE_KEYS:
+            fdata[key] = pack_lines(fdata[key])
+        for key in ARC_KEYS:
+            if key in fdata:
+                fdata[key] = _to_bytes([line for arc in fdata[key]
+                                        for line in arc])
+        packed[filename] = fdata
+    return packed
+
+
+def unpack_files(packed):
+    """Decode per-file results encoded by ``pack_files``"""
+    files = {}
+    for filename, fdata in packed.items():
+        fdata = dict(fdata)
+        for key in LINE_KEYS:
+            fdata[key] = unpack_lines(fdata[key])
+        for key in ARC_KEYS:
+            if key in fdata:
+                lines = _from_bytes(fdata[key])
+                fdata[key] = list(zip(lines[::2], lines[1::2]))
+        files[filename] = fdata
+    return files
+
+
+def compare_files(old, new):
+    """
+    Compare the per-file results ``old`` and ``new``, encoded by
+    ``pack_files``.
+
+    Returns a dict mapping the files whose coverage changed to a dict with
+    their ``(executed, statements)`` counts ``before`` and ``after`` (None if
+    the file was not measured), and their encoded results ``old`` and
+    ``new`` (see ``line_delta``).
+
+    Only the counts are computed: the lines of a file are only decoded when
+    shown, so that comparing runs of many changed files stays fast.
+    """
+    delta = {}
+    for filename in set(old) | set(new):
+        before, after = old.get(filename), new.get(filename)
+        if before is not None and after is not None \
+           and before['executed'] == after['executed'] \
+           and before['missing'] == after['missing']:
+            # Same encoded lines: nothing to decode
+            continue
+        counts = [None if fdata is None
+                  else (count_lines(fdata['executed']),
+                        count_lines(fdata['statements']))
+                  for fdata in (before, after)]
+        delta[filename] = {'before': counts[0], 'after': counts[1],
+                           'old': before, 'new': after}
+    return delta
+
+
+def line_delta(fdelta):
+    """
+    Return the lines of a file of a ``compare_files`` result executed in the
+    new run that the old one missed (gained), the lines missed in the new
+    run that the old one executed (lost), and the statements of the file
+    """
+    lines = []
+    for fdata in (fdelta['old'], fdelta['new']):
+        if fdata is None:
+            lines.append((set(), set(), []))
+        else:
+            lines.append((set(unpack_lines(fdata['executed'])),
+                          set(unpack_lines(fdata['missing'])),
+                          unpack_lines(fdata['statements'])))
+    (old_executed, old_missing, statements), \
+        (new_executed, new_missing, new_statements) = lines
+    return (sorted(new_executed & old_missing),
+            sorted(new_missing & old_executed),
+            new_statements if fdelta['new'] is not None else statements)
+
+
+def _is_sqlite_file(path):
+    """Return True if ``path`` is a SQLite database"""
+    with open(path, 'rb') as fobj:
+        return fobj.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def _is_corrupted(error):
+    """
+    Return True if the SQLite ``error`` tells that the database file is
+    corrupted or not a database, rather than e.g. locked
+    """
+    name = getattr(error, 'sqlite_errorname', None)  # Python 3.11+
+    if name is not None:
+        return name in ('SQLITE_NOTADB', 'SQLITE_CORRUPT')
+    message = str(error).lower()
+    return not isinstance(error, sqlite3.OperationalError) \
+        and ('not a database' in message or 'malformed' in message)
+
+
+def _set_aside(path):
+    """
+    Rename the file ``path``, which cannot be used as the store, to a free
+    ``<path>.old`` name, so that it is never lost
+    """
+    target = path + '.old'
+    index = 1
+    while osp.exists(target):
+        target = '%s.old%d' % (path, index)
+        index += 1
+    os.rename(path, target)
+
+
+class ResultsStore(object):
+    """
+    Coverage results history.
+
+    Entries are ``data`` dicts (whose ``date`` key is a ``time.struct_time``
+    and ``files`` key the per-file results of the worker) indexed by absolute
+    filename, and ordered from the most to the least recently set. Only the
+    ``max_entries`` most recent entries are kept.
+
+    Setting an entry moves the former one to the runs of the file, of which
+    the ``max_runs`` most recent are kept.
+    """
+    def __init__(self, path, version, max_entries=100, max_runs=10):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.max_runs = max_runs
+        if osp.isfile(path) and not _is_sqlite_file(path):
+            # The log of the former pickle-based history: its text reports
+            # cannot be converted to per-file results
+            _set_aside(path)
+        try:
+            self.connection = self._connect()
+        except sqlite3.DatabaseError as error:
+            # Only a corrupted database is started again from scratch (a
+            # locked one is not): its file is kept aside
+            if not _is_corrupted(error):
+                raise
+            _set_aside(path)
+            self.connection = self._connect()
+
+    def _connect(self):
+        """Open the database, creating or resetting the tables if needed"""
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        try:
+            self._create_tables(connection)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
+
+    def _create_tables(self, connection):
+        """Create or reset the tables of the database of ``connection``"""
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS meta "
+                               "(key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS entries "
+                               "(filename TEXT PRIMARY KEY, seq INTEGER, "
+                               "date REAL, data BLOB)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_seq "
+                               "ON entries (seq)")
+            connection.execute("CREATE TABLE IF NOT EXISTS runs "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "filename TEXT, date REAL, data BLOB)")
+            connection.execute("CREATE INDEX IF NOT EXISTS runs_filename "
+                               "ON runs (filename, id)")
+            connection.execute("CREATE TABLE IF NOT EXISTS test_indexes "
+                               "(filename TEXT PRIMARY KEY, data BLOB)")
+            connection.execute("CREATE TABLE IF NOT EXISTS scopes "
+                               "(root TEXT PRIMARY KEY, data BLOB)")
+            row = connection.execute("SELECT value FROM meta "
+                                     "WHERE key = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                connection.execute("DELETE FROM entries")
+                connection.execute("DELETE FROM runs")
+                connection.execute("DELETE FROM test_indexes")
+                connection.execute("INSERT OR REPLACE INTO meta "
+                                   "VALUES ('version', ?)", (self.version,))
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def filenames(self):
+        """Return the filenames of the entries, most recent first"""
+        cursor = self.connection.execute("SELECT filename FROM entries "
+                                         "ORDER BY seq DESC")
+        return [row[0] for row in cursor]
+
+    def _load(self, query, args, unpack=True):
+        """Return the data of the first row of ``query``, None if none"""
+        row = self.connection.execute(query, args).fetchone()
+        if row is None:
+            return None
+        data = pickle.loads(zlib.decompress(bytes(row[0])))
+        if unpack:
+            data['files'] = unpack_files(data['files'])
+        return data
+
+    def get(self, filename):
+        """Return the data stored for ``filename``, None if there is none"""
+        return self._load("SELECT data FROM entries WHERE filename = ?",
+                          (filename,))
+
+    def set(self, filename, data):
+        """Store ``data`` for ``filename``, making it the most recent entry"""
+        packed = dict(data, files=pack_files(data['files']))
+        blob = sqlite3.Binary(zlib.compress(pickle.dumps(packed, 2)))
+        with self.connection:
+            self.connection.execute("INSERT INTO runs (filename, date, data) "
+                                    "SELECT filename, date, data "
+                                    "FROM entries WHERE filename = ?",
+                                    (filename,))
+            self.connection.execute("DELETE FROM runs WHERE filename = ? "
+                                    "AND id NOT IN (SELECT id FROM runs "
+                                    "WHERE filename = ? "
+                                    "ORDER BY id DESC LIMIT ?)",
+                                    (filename, filename, self.max_runs))
+            seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) + 1 "
+                                          "FROM entries").fetchone()[0]
+            self.connection.execute("INSERT OR REPLACE INTO entries "
+                                    "VALUES (?, ?, ?, ?)",
+                                    (filename, seq, time.mktime(data['date']),
+                                     blob))
+            self._prune()
+
+    def runs(self, filename):
+        """
+        Return the previous runs of ``filename`` as ``(run_id, date)``
+        pairs (``date`` being a ``time.struct_time``), most recent first
+        """
+        cursor = self.connection.execute("SELECT id, date FROM runs "
+                                         "WHERE filename = ? "
+                                         "ORDER BY id DESC", (filename,))
+        return [(run_id, time.localtime(date)) for run_id, date in cursor]
+
+    def compare(self, filename, run_id):
+        """
+        Return the changes of coverage of the current entry of ``filename``
+        since its run ``run_id`` (see ``compare_files``), None if either is
+        missing
+        """
+        new = self._load("SELECT data FROM entries WHERE filename = ?",
+                         (filename,), unpack=False)
+        old = self._load("SELECT data FROM runs WHERE id = ?", (run_id,),
+                         unpack=False)
+        if new is None or old is None:
+            return None
+        return compare_files(old['files'], new['files'])
+
+    def remove(self, filenames):
+        """Remove the entries of ``filenames``, and their runs"""
+        with self.connection:
+            self.connection.executemany("DELETE FROM entries "
+                                        "WHERE filename = ?",
+                                        [(filename,) for filename in filenames])
+            self.connection.executemany("DELETE FROM runs "
+                                        "WHERE filename = ?",
+                                        [(filename,) for filename in filenames])
+
+    def get_test_index(self, filename):
+        """
+        Return the test index of the package ``filename`` (see
+        ``coverageimpact``), None if there is none
+        """
+        row = self.connection.execute("SELECT data FROM test_indexes "
+                                      "WHERE filename = ?",
+                                      (filename,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(zlib.decompress(bytes(row[0])))
+
+    def set_test_index(self, filename, index):
+        """Store the test ``index`` of ``filename``, or remove it if None"""
+        with self.connection:
+            if index is None:
+                self.connection.execute("DELETE FROM test_indexes "
+                                        "WHERE filename = ?", (filename,))
+                return
+            blob = zlib.compress(pickle.dumps(index, 2))
+            self.connection.execute("INSERT OR REPLACE INTO test_indexes "
+                                    "VALUES (?, ?)",
+                                    (filename, sqlite3.Binary(blob)))
+
+    def get_scope(self, root):
+        """
+        Return the measurement scope of the project ``root``: a dict with
+        ``source`` and ``omit`` lists, None if there is none
+        """
+        row = self.connection.execute("SELECT data FROM scopes "
+                                      "WHERE root = ?", (root,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(bytes(row[0]))
+
+    def set_scope(self, root, scope):
+        """Store the measurement ``scope`` of ``root``, remove it if None"""
+        with self.connection:
+            if scope is None:
+                self.connection.execute("DELETE FROM scopes WHERE root = ?",
+                                        (root,))
+                return
+            self.connection.execute("INSERT OR REPLACE INTO scopes "
+                                    "VALUES (?, ?)",
+                                    (root,
+                                     sqlite3.Binary(pickle.dumps(scope, 2))))
+
+    def _prune(self):
+        """Remove the entries beyond ``max_entries``"""
+        row = self.connection.execute("SELECT seq FROM entries "
+                                      "ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                                      (self.max_entries,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM runs WHERE filename IN "
+                                    "(SELECT filename FROM entries "
+                                    "WHERE seq <= ?)", row)
+            self.connection.execute("DELETE FROM entries WHERE seq <= ?", row)
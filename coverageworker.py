@@ -0,0 +1,1079 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Coverage worker
+
+Runs a Python script under coverage measurement and writes the measured data
+(statements, executed and missing lines, branch arcs) to a single JSON results
+file. The coverage widget starts this script instead of ``coverage run``
+followed by ``coverage report``, so an analysis costs one interpreter startup
+and no re-read of the ``.coverage`` data file.
+
+This module must only depend on the standard library and ``coverage``: it runs
+in the interpreter of the code under test, not inside Spyder.
+
+Usage::
+
+    python coverageworker.py --output results.json script.py [args ...]
+    python coverageworker.py --server [--preload numpy,pandas]
+    python coverageworker.py --tests --data-file DATA test_a.py test_b.py
+    python coverageworker.py --combine --data-file DATA --output results.json
+                             package
+    python coverageworker.py --html DIRECTORY --data-file DATA script.py
+
+Measurement settings (``--core``, ``--branch``, ``--source``, ``--include``,
+``--omit``, ``--subprocess``) apply to all modes.
+"""
+
+# pylint: disable=C0103
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path as osp
+import time
+import json
+import errno
+import select
+import signal
+import zlib
+import hashlib
+import argparse
+import runpy
+import shutil
+import tempfile
+import traceback
+
+RESULTS_VERSION = 1
+
+# When the worker started (or the fork server forked the job): the client
+# measures the startup time of the worker from it
+STARTED = time.time()
+
+# Measurement cores of coverage 7.4+ (``COVERAGE_CORE``): the C tracer, the
+# Python tracer and sys.monitoring (Python 3.12+, the fastest)
+CORES = ('ctrace', 'pytrace', 'sysmon')
+
+
+def get_coverage_class():
+    """Return the coverage class, whatever the coverage version"""
+    import coverage
+    return getattr(coverage, 'Coverage', None) or coverage.coverage
+
+
+def create_coverage(settings=None, **kwargs):
+    """
+    Return a coverage object measuring with the measurement ``settings``: a
+    dict with optional ``core``, ``branch``, ``source``, ``include`` and
+    ``omit`` keys (the latter three being lists), and ``subprocess`` (see
+    ``subprocess_config``). ``kwargs`` are passed to the coverage class.
+    """
+    settings = settings or {}
+    if settings.get('core'):
+        # Also applies to the subprocesses of the measured code
+        os.environ['COVERAGE_CORE'] = settings['core']
+    if settings.get('branch'):
+        kwargs['branch'] = True
+    for key in ('source', 'include', 'omit'):
+        if settings.get(key):
+            kwargs[key] = list(settings[key])
+    return get_coverage_class()(**kwargs)
+
+
+def settings_args(settings):
+    """Return the command line arguments of the measurement ``settings``"""
+    settings = settings or {}
+    args = []
+    if settings.get('core'):
+        args += ['--core', settings['core']]
+    if settings.get('branch'):
+        args.append('--branch')
+    if settings.get('subprocess'):
+        args.append('--subprocess')
+    for key in ('source', 'include', 'omit'):
+        if settings.get(key):
+            args += ['--' + key, ','.join(settings[key])]
+    return args
+
+
+SITECUSTOMIZE = """\
+import coverage
+coverage.process_startup()
+"""
+
+
+def subprocess_config(data_file, settings, directory):
+    """
+    Measure the processes started by the measured code (``subprocess``,
+    ``multiprocessing``...) too: write the configuration they are measured
+    with in ``directory``, and return its path.
+
+    Each process saves its data to a ``<data_file>.<suffix>`` file, to be
+    combined with those of the other processes. The settings have to be in a
+    configuration file, since the processes do not inherit the arguments of
+    the coverage object. With coverage older than 7.10, processes started by
+    ``subprocess`` start measuring through a ``sitecustomize`` module.
+    """
+    import coverage
+    lines = ['[run]', 'parallel = True', 'data_file = ' + data_file,
+             'concurrency = multiprocessing, thread']
+    if settings.get('branch'):
+        lines.append('branch = True')
+    for key in ('source', 'include', 'omit'):
+        if settings.get(key):
+            lines.append(key + ' =')
+            lines += ['    ' + item for item in settings[key]]
+    # No ``sigterm``: stopping coverage in a pool worker terminated by its
+    # pool may fail, and leave the pool waiting for it forever (see
+    # ``join_pools_on_exit`` instead)
+    version = getattr(coverage, 'version_info', (0,))
+    patched = version >= (7, 10)
+    if patched:
+        lines.append('patch = subprocess')
+    path = osp.join(directory, 'coveragerc')
+    with open(path, 'w') as fobj:
+        fobj.write('\n'.join(lines) + '\n')
+    if not patched:
+        with open(osp.join(directory, 'sitecustomize.py'), 'w') as fobj:
+            fobj.write(SITECUSTOMIZE)
+        paths = [directory] + [item for item in
+                               [os.environ.get('PYTHONPATH')] if item]
+        os.environ['PYTHONPATH'] = os.pathsep.join(paths)
+        os.environ['COVERAGE_PROCESS_START'] = path
+    return path
+
+
+def join_pools_on_exit():
+    """
+    Make the ``multiprocessing`` pools without pending tasks close and join
+    their workers on leaving a ``with Pool()`` block, instead of terminating
+    them, and return the original ``Pool.__exit__`` (None if pools are not
+    context managers, on Python 2).
+
+    Terminated workers are killed before coverage saves their data: their
+    lines would be reported missing. Pools with pending tasks (e.g. results
+    of ``apply_async`` never waited for) or left on an exception are still
+    terminated, as without measurement. Pools created in processes started
+    with the ``spawn`` or ``forkserver`` methods are not patched.
+    """
+    try:
+        from multiprocessing.pool import Pool
+    except ImportError:
+        return None
+    terminate_exit = Pool.__dict__.get('__exit__')
+    if terminate_exit is None:
+        return None
+
+    def join_exit(self, exc_type, exc_value, exc_traceback):
+        """Close and join the pool if it has no pending tasks"""
+        if exc_type is None and not getattr(self, '_cache', True):
+            self.close()
+            self.join()
+        return terminate_exit(self, exc_type, exc_value, exc_traceback)
+
+    Pool.__exit__ = join_exit
+    return terminate_exit
+
+
+def split_list(text):
+    """Return the items of a comma-separated list"""
+    return [item.strip() for item in (text or '').split(',') if item.strip()]
+
+
+def measure_settings(core='', branch=False, source='', include='', omit='',
+                     subprocess=False):
+    """
+    Return the measurement settings (see ``create_coverage``), the
+    ``source``, ``include`` and ``omit`` lists being comma-separated. The
+    plugin and the command lines build them alike, so that the results of
+    either are reused by the others.
+    """
+    return {'core': core or '', 'branch': bool(branch),
+            'source': split_list(source), 'include': split_list(include),
+            'omit': split_list(omit), 'subprocess': bool(subprocess)}
+
+
+def add_measure_options(parser):
+    """Add the options of the measurement settings to the argparse ``parser``"""
+    parser.add_argument('--core', choices=CORES,
+                        help="measurement core (coverage 7.4+)")
+    parser.add_argument('--branch', action='store_true',
+                        help="measure branch coverage")
+    parser.add_argument('--source',
+                        help="comma-separated packages or directories to "
+                             "measure")
+    parser.add_argument('--include',
+                        help="comma-separated file patterns to measure")
+    parser.add_argument('--omit',
+                        help="comma-separated file patterns not to measure")
+    parser.add_argument('--subprocess', action='store_true',
+                        help="also measure the processes started by the "
+                             "measured code")
+
+
+def settings_from_args(options):
+    """Return the measurement settings of the parsed command line ``options``"""
+    return measure_settings(options.core, options.branch, options.source,
+                            options.include, options.omit, options.subprocess)
+
+
+def _exit_status(exc):
+    """Return the exit status corresponding to a SystemExit instance"""
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+def run_script(filename, args, namespace=None):
+    """
+    Run ``filename`` as ``__main__``, the way ``coverage run`` does, or in
+    ``namespace`` if given, the way Spyder's ``runfile`` does.
+
+    Returns the exit status of the script.
+    """
+    filename = osp.abspath(filename)
+    old_argv, old_path0 = sys.argv, sys.path[0]
+    sys.argv = [filename] + list(args)
+    sys.path[0] = osp.dirname(filename)
+    try:
+        if namespace is None:
+            runpy.run_path(filename, run_name='__main__')
+        else:
+            namespace.update(__name__='__main__', __file__=filename)
+            with open(filename, 'rb') as fobj:
+                code = compile(fobj.read(), filename, 'exec')
+            exec(code, namespace)
+        return 0
+    except SystemExit as exc:
+        return _exit_status(exc)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv, sys.path[0] = old_argv, old_path0
+
+
+def _is_worker_file(filename):
+    """Return True if ``filename`` is this module (which is measured too)"""
+    this = osp.splitext(osp.normcase(osp.realpath(__file__)))[0]
+    return osp.splitext(osp.normcase(osp.realpath(filename)))[0] == this
+
+
+def line_hashes(filename):
+    """Return the CRC-32 of each line of ``filename``"""
+    with open(filename, 'rb') as fobj:
+        return [zlib.crc32(line) & 0xffffffff for line in fobj]
+
+
+def collect_contexts(data, filenames):
+    """
+    Return the lines executed by each dynamic context (i.e. by each test),
+    as a ``{context: {filename: [lines]}}`` dict.
+    """
+    contexts = {}
+    for filename in filenames:
+        for line, names in data.contexts_by_lineno(filename).items():
+            for name in names:
+                lines = contexts.setdefault(name, {})
+                lines.setdefault(osp.abspath(filename), []).append(line)
+    for lines in contexts.values():
+        for filename in lines:
+            lines[filename].sort()
+    return contexts
+
+
+def collect(cov, extra_files=()):
+    """
+    Return the data measured by ``cov`` as a JSON-serializable dict.
+
+    Per-file entries hold sorted line lists; when branch coverage was
+    measured, they also hold the executed and missing arcs. The
+    ``extra_files`` are analyzed even if nothing was measured in them.
+
+    When the data has dynamic contexts (see ``run_tests``), the results also
+    hold the lines executed per context and the line hashes of the files,
+    used for test impact analysis.
+    """
+    data = cov.get_data()
+    branch = data.has_arcs()
+    files = {}
+    measured = [filename for filename in data.measured_files()
+                if not _is_worker_file(filename)]
+    for filename in measured + [name for name in extra_files
+                                if osp.isfile(name)]:
+        try:
+            # coverage has no public per-file API exposing branch numbers
+            analysis = cov._analyze(filename)
+        except Exception:  # NoSource, NotPython...
+            continue
+        statements = set(analysis.statements)
+        missing = set(analysis.missing)
+        fdata = {'statements': sorted(statements),
+                 'executed': sorted(statements - missing),
+                 'missing': sorted(missing),
+                 'excluded': sorted(analysis.excluded)}
+        if branch:
+            numbers = analysis.numbers
+            missing_arcs = analysis.missing_branch_arcs()
+            fdata['arcs'] = sorted(data.arcs(filename) or [])
+            fdata['missing_arcs'] = sorted([start, end]
+                                           for start in missing_arcs
+                                           for end in missing_arcs[start])
+            fdata['branches'] = numbers.n_branches
+            fdata['partial'] = numbers.n_partial_branches
+            fdata['missing_branches'] = numbers.n_missing_branches
+        files[osp.abspath(filename)] = fdata
+    results = {'version': RESULTS_VERSION, 'branch': branch, 'files': files}
+    measured_contexts = getattr(data, 'measured_contexts', None)  # >= 5.0
+    if measured_contexts is not None and set(measured_contexts()) - set(['']):
+        results['contexts'] = collect_contexts(data, measured)
+        results['hashes'] = dict((filename, line_hashes(filename))
+                                 for filename in files)
+    return results
+
+
+def file_digest(filename):
+    """Return the SHA-1 hex digest of the contents of ``filename``"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(filename):
+    """
+    Return the ``[mtime, size, sha1]`` fingerprint of ``filename``, or None
+    if it does not exist.
+    """
+    try:
+        stat = os.stat(filename)
+        return [stat.st_mtime, stat.st_size, file_digest(filename)]
+    except (IOError, OSError):
+        return None
+
+
+def has_changed(filename, fprint):
+    """
+    Return True if ``filename`` no longer matches its fingerprint ``fprint``.
+
+    The file is only hashed when its modification time changed but not its
+    size, e.g. when it was saved without any modification.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return True
+    mtime, size, digest = fprint
+    if stat.st_size != size:
+        return True
+    if stat.st_mtime == mtime:
+        return False
+    try:
+        return file_digest(filename) != digest
+    except (IOError, OSError):
+        return True
+
+
+def save_data(cov, path):
+    """
+    Save the data measured by ``cov`` to the data file ``path``, replacing
+    it, e.g. for an HTML report generated later by ``html_report``
+    """
+    data = cov.get_data()
+    temp = '%s.%d' % (path, os.getpid())
+    if hasattr(data, 'write_file'):     # coverage < 5
+        data.write_file(temp)
+    else:
+        copy = type(data)(basename=temp)
+        copy.update(data)
+        copy.write()
+        if hasattr(copy, 'close'):
+            copy.close()
+    if osp.exists(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+def html_report(data_file, target, directory, settings=None):
+    """
+    Write the HTML report of the data file ``data_file`` of ``target`` to
+    ``directory``.
+
+    The report is incremental: coverage only rewrites the pages of the files
+    whose data or source changed since the report was last written to
+    ``directory``.
+    """
+    cov = create_coverage(settings, data_file=data_file)
+    cov.load()
+    try:
+        cov.html_report(directory=directory, title=osp.basename(target))
+    except Exception:  # NoDataError: nothing was measured
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def try_save_data(cov, path):
+    """
+    Save the data of ``cov`` to ``path``, reporting failures (e.g. the file
+    being read on Windows) without failing the analysis
+    """
+    try:
+        save_data(cov, path)
+    except Exception:
+        traceback.print_exc()
+
+
+def write_results(results, path):
+    """Write the results dict to ``path`` as JSON"""
+    with open(path, 'w') as fobj:
+        json.dump(results, fobj)
+
+
+#==============================================================================
+# Test suites
+#==============================================================================
+def is_test_module(filename):
+    """Return True if ``filename`` looks like a test module"""
+    name = osp.basename(filename)
+    return name.endswith('.py') \
+        and (name.startswith('test_') or name.endswith('_test.py'))
+
+
+def find_test_modules(package):
+    """Return the sorted paths of the test modules found under ``package``"""
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(package):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        modules.extend(osp.join(dirpath, name) for name in filenames
+                       if is_test_module(name))
+    return sorted(modules)
+
+
+def _test_weight(name):
+    """
+    Return the estimated run time of the test module or test id ``name``:
+    the size of a module, and 1 for a single test.
+    """
+    try:
+        return os.stat(name).st_size
+    except OSError:
+        return 1
+
+
+def shard_modules(modules, count):
+    """
+    Split ``modules`` (test module paths or test ids) into at most ``count``
+    shards of similar estimated run time.
+    """
+    shards = [[] for _index in range(max(1, min(count, len(modules))))]
+    weights = [0] * len(shards)
+    for module in sorted(modules, key=lambda name: -_test_weight(name)):
+        index = weights.index(min(weights))
+        shards[index].append(module)
+        weights[index] += _test_weight(module)
+    return [sorted(shard) for shard in shards if shard]
+
+
+def module_name(filename):
+    """
+    Return the dotted name of the module ``filename`` and the directory to
+    put in ``sys.path`` to import it by that name.
+    """
+    dirname, name = osp.split(osp.abspath(filename))
+    names = [osp.splitext(name)[0]]
+    while osp.isfile(osp.join(dirname, '__init__.py')):
+        dirname, name = osp.split(dirname)
+        names.insert(0, name)
+    return '.'.join(names), dirname
+
+
+class _ContextPlugin(object):
+    """pytest plugin switching the coverage context to the running test"""
+    def __init__(self, cov):
+        self.cov = cov
+
+    def pytest_runtest_setup(self, item):
+        """Switch to the context of ``item``, identified by absolute node id"""
+        rootdir = str(item.session.config.rootdir)
+        self.cov.switch_context(osp.join(rootdir, item.nodeid))
+
+    def pytest_runtest_logfinish(self, nodeid, location):
+        """Back to the empty context between tests"""
+        self.cov.switch_context('')
+
+
+def _context_result_class(cov):
+    """Return a unittest result class switching the coverage context"""
+    import unittest
+
+    class ContextResult(unittest.TextTestResult):
+        """Test result switching the coverage context to the running test"""
+        def startTest(self, test):
+            cov.switch_context(test.id())
+            unittest.TextTestResult.startTest(self, test)
+
+        def stopTest(self, test):
+            unittest.TextTestResult.stopTest(self, test)
+            cov.switch_context('')
+    return ContextResult
+
+
+def run_tests(names, cov=None):
+    """
+    Run the tests ``names`` with pytest if it is installed, with unittest
+    otherwise. Names are test module paths or test ids (pytest node ids with
+    an absolute path, or unittest ids).
+
+    If ``cov`` is given, each test runs in its own coverage context, named
+    after its id.
+
+    Returns the exit status of the test run.
+    """
+    if not names:
+        return 0
+    try:
+        import pytest
+    except ImportError:
+        pytest = None
+    try:
+        if pytest is not None:
+            plugins = [] if cov is None else [_ContextPlugin(cov)]
+            return int(pytest.main(list(names), plugins=plugins))
+        import unittest
+        # test ids are relative to the root of the package being tested
+        root = module_name(osp.join(os.getcwd(), '__init__.py'))[1]
+        paths = [root]
+        ids = []
+        for name in names:
+            if name.endswith('.py'):
+                name, path = module_name(name)
+                paths.append(path)
+            ids.append(name)
+        for path in paths:
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        suite = unittest.defaultTestLoader.loadTestsFromNames(ids)
+        runner = unittest.TextTestRunner(stream=sys.stderr)
+        if cov is not None:
+            runner.resultclass = _context_result_class(cov)
+        return 0 if runner.run(suite).wasSuccessful() else 1
+    except SystemExit as exc:
+        return _exit_status(exc)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+
+
+#==============================================================================
+# Measurement
+#==============================================================================
+def finish_results(cov, filename, status, extra_files=(), timings=None):
+    """
+    Return the results of ``cov`` for the measured target ``filename``.
+
+    ``timings`` maps the phases of the worker to their durations (seconds),
+    the ``started`` key being the time the worker started: it is completed
+    with the ``collect`` phase and added to the results.
+    """
+    start = time.time()
+    results = collect(cov, extra_files)
+    results['filename'] = osp.abspath(filename)
+    results['status'] = status
+    results['modules'] = third_party_modules()
+    sources = [results['filename']] + list(results['files'])
+    results['sources'] = dict((source, fingerprint(source))
+                              for source in sources if osp.isfile(source))
+    results['timings'] = dict(timings or {}, started=STARTED,
+                              collect=time.time() - start)
+    return results
+
+
+def measure(filename, args, output=None, tests=False, data_file=None,
+            settings=None, save_to=None, namespace=None):
+    """
+    Run ``filename`` under coverage and write the results to ``output``.
+
+    With ``tests``, ``filename`` and ``args`` are test modules run by
+    ``run_tests``. With ``data_file``, the data is also saved to a
+    ``<data_file>.<suffix>`` file, to be merged later by ``combine``.
+    ``settings`` are the measurement settings (see ``create_coverage``).
+    With ``save_to``, the data is also saved to that file (see
+    ``save_data``). The script is run in ``namespace`` if given (see
+    ``run_script``).
+
+    Returns the exit status of the script.
+    """
+    settings = settings or {}
+    tempdir = None
+    if settings.get('subprocess'):
+        # The processes save their data next to ``data_file``, or else to a
+        # temporary directory, their data being combined below
+        tempdir = tempfile.mkdtemp(prefix='coverage-')
+        parallel_file = data_file or osp.join(tempdir, '.coverage')
+        rcfile = subprocess_config(parallel_file, settings, tempdir)
+        cov = create_coverage(settings, config_file=rcfile,
+                              data_file=parallel_file, data_suffix=True)
+    else:
+        # data_file=None: keep the data in memory, there is no report step
+        # that would need to read it back from disk
+        cov = create_coverage(settings, data_file=data_file,
+                              data_suffix=data_file is not None)
+    timings = {}
+    pool_exit = None
+    if tempdir is not None:
+        pool_exit = join_pools_on_exit()
+    try:
+        start = time.time()
+        cov.start()
+        try:
+            if tests:
+                status = run_tests([filename] + list(args), cov)
+            else:
+                status = run_script(filename, args, namespace)
+        finally:
+            cov.stop()
+            if pool_exit is not None:
+                from multiprocessing.pool import Pool
+                Pool.__exit__ = pool_exit
+        timings['run'] = time.time() - start
+
+        if data_file is not None or tempdir is not None:
+            start = time.time()
+            cov.save()
+            timings['save'] = time.time() - start
+        if data_file is None and tempdir is not None:
+            start = time.time()
+            cov.combine()
+            timings['combine'] = time.time() - start
+        if save_to is not None:
+            start = time.time()
+            try_save_data(cov, save_to)
+            timings['save'] = timings.get('save', 0) + time.time() - start
+        if output is not None:
+            write_results(finish_results(cov, filename, status,
+                                         timings=timings), output)
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir, ignore_errors=True)
+    return status
+
+
+def combine(data_file, target, output, extra_files=(), settings=None,
+            save_to=None):
+    """
+    Combine the ``<data_file>.<suffix>`` files saved by several ``measure``
+    calls and write the results for ``target`` to ``output``, and the
+    combined data to ``save_to`` if given.
+    """
+    cov = create_coverage(settings, data_file=data_file)
+    start = time.time()
+    try:
+        cov.combine()
+    except Exception:  # no data to combine: no test was run
+        pass
+    timings = {'combine': time.time() - start}
+    if save_to is not None:
+        start = time.time()
+        try_save_data(cov, save_to)
+        timings['save'] = time.time() - start
+    write_results(finish_results(cov, target, 0, extra_files, timings),
+                  output)
+
+
+# Environment variables set for the measurement (see ``create_coverage`` and
+# ``subprocess_config``)
+MEASURE_ENVIRON = ('COVERAGE_CORE', 'PYTHONPATH', 'COVERAGE_PROCESS_START')
+
+# Seconds between two touches of the heartbeat file of a console analysis
+HEARTBEAT_INTERVAL = 1
+
+
+def heartbeat_path(output):
+    """
+    Return the path of the file touched while the console analysis writing
+    ``output`` runs: the client tells from it that the console is alive
+    """
+    return output + '.alive'
+
+
+def cancel_path(output):
+    """
+    Return the path of the file created by the client when it cancels the
+    console analysis writing ``output``, which it cannot stop
+    """
+    return output + '.cancel'
+
+
+def start_heartbeat(path):
+    """
+    Create ``path`` and touch it every ``HEARTBEAT_INTERVAL`` seconds from a
+    thread, and return the event stopping it
+    """
+    import threading
+    open(path, 'w').close()
+    stop = threading.Event()
+
+    def beat():
+        """Touch the heartbeat file until stopped"""
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+    return stop
+
+
+def measure_in_console(filename, output, settings=None, save_to=None):
+    """
+    Measure ``filename`` run in the namespace of the interactive console
+    running this function, the way Spyder's ``runfile`` does: the modules
+    imported by the console and its variables are reused. Module-level code
+    of the modules already imported is not measured again.
+
+    The results are written to ``output`` once complete: the console does
+    not report the end of the code it runs, so the file is polled for, while
+    the analysis touches its ``heartbeat_path``. The working directory and
+    the environment variables set for the measurement are restored, the
+    console outliving the analysis. An analysis cancelled by the client (see
+    ``cancel_path``) is not run, or its results and data are discarded.
+    """
+    global STARTED
+    STARTED = time.time()
+    cancelled = cancel_path(output)
+    if osp.exists(cancelled):
+        os.remove(cancelled)
+        return
+    heartbeat = heartbeat_path(output)
+    stop_heartbeat = start_heartbeat(heartbeat)
+    partial = output + '.part'
+    cwd = os.getcwd()
+    environ = dict((key, os.environ.get(key)) for key in MEASURE_ENVIRON)
+    try:
+        os.chdir(osp.dirname(osp.abspath(filename)))
+        measure(filename, [], partial, settings=settings, save_to=save_to,
+                namespace=sys.modules['__main__'].__dict__)
+    finally:
+        os.chdir(cwd)
+        for key, value in environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        if not osp.exists(partial):
+            # The analysis failed: an empty results file tells so
+            open(partial, 'w').close()
+        if osp.exists(cancelled):
+            # Nobody waits for the results anymore
+            for path in (cancelled, partial, save_to):
+                if path is not None and osp.exists(path):
+                    os.remove(path)
+        else:
+            os.rename(partial, output)
+        stop_heartbeat.set()
+        os.remove(heartbeat)
+
+
+def console_code(filename, output, settings=None, save_to=None):
+    """
+    Return the line of code running ``measure_in_console`` in a console,
+    which may run another interpreter than Spyder's: this module is run from
+    its file, its functions being left out of the console namespace
+    """
+    path = osp.abspath(__file__)
+    return ("__coverage = {'__name__': 'coverageworker', '__file__': %r}; "
+            "exec(compile(open(%r).read(), %r, 'exec'), __coverage); "
+            "__coverage['measure_in_console'](%r, %r, %r, %r); "
+            "del __coverage" % (path, path, path, filename, output, settings,
+                                save_to))
+
+
+#==============================================================================
+# Fork server
+#==============================================================================
+def _is_third_party(filename):
+    """Return True if ``filename`` belongs to an installed distribution"""
+    parts = osp.normcase(osp.abspath(filename)).split(os.sep)
+    return 'site-packages' in parts or 'dist-packages' in parts
+
+
+def third_party_modules():
+    """
+    Return the names of the imported top-level modules that are installed
+    packages (numpy, pandas...): those are safe to pre-import in the fork
+    server because they are never the code under measurement.
+    """
+    names = set()
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if '.' not in name and filename and _is_third_party(filename):
+            names.add(name)
+    return sorted(names)
+
+
+def module_stamps():
+    """Return the modification times of the source files of all modules"""
+    stamps = {}
+    for module in list(sys.modules.values()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            try:
+                stamps[filename] = os.stat(filename).st_mtime
+            except OSError:
+                pass
+    return stamps
+
+
+def is_stale(stamps):
+    """Return True if any file recorded in ``stamps`` changed"""
+    for filename, mtime in stamps.items():
+        try:
+            if os.stat(filename).st_mtime != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def preload(names):
+    """Import the modules ``names``, ignoring those that fail to import"""
+    for name in names:
+        if name in sys.modules:
+            continue
+        try:
+            __import__(name)
+        except Exception:
+            print("coverage worker: could not preload %r" % name,
+                  file=sys.stderr)
+
+
+def reply(message):
+    """Send a message to the client on the control channel (stdout)"""
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+
+def run_child(job):
+    """Measure ``job`` in a freshly forked child; never returns"""
+    global STARTED
+    STARTED = time.time()
+    status = 1
+    try:
+        # stdout is the control channel, and stderr is shared by the jobs
+        # running at the same time: the output of the script goes to a file
+        # of its own
+        log = os.open(job['log'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                      0o600)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        os.close(log)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.chdir(job['cwd'])
+        status = measure(job['filename'], job.get('args', []), job['output'],
+                         settings=job.get('settings'),
+                         save_to=job.get('save_data'))
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def child_wakeup():
+    """
+    Return the read end of a pipe written to whenever a child exits, so that
+    the server can wait for both its jobs and its children
+    """
+    import fcntl
+    read_fd, write_fd = os.pipe()
+    for fd in (read_fd, write_fd):
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.set_wakeup_fd(write_fd)
+    # The handler only needs to exist for the wakeup fd to be written
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    return read_fd
+
+
+def reset_child_wakeup(read_fd):
+    """Undo ``child_wakeup`` in a forked child"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    write_fd = signal.set_wakeup_fd(-1)
+    for fd in (read_fd, write_fd):
+        os.close(fd)
+
+
+def reap_children(block=False):
+    """Generate the ``(pid, returncode)`` of the exited children"""
+    while True:
+        try:
+            pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except OSError as error:
+            if error.errno == errno.EINTR:
+                continue
+            # No child left
+            return
+        if pid == 0:
+            return
+        yield pid, (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                    else -os.WTERMSIG(status))
+
+
+def serve(modules):
+    """
+    Fork server main loop.
+
+    The server imports coverage and the ``modules`` once, then reads one JSON
+    job per line on stdin and forks a clean child to measure each of them,
+    the jobs running at the same time. Replies are JSON lines on stdout:
+    ``{"ready": pid}`` at startup, then ``{"id": id, "pid": pid}`` when a job
+    starts and ``{"id": id, "returncode": code}`` when it is done.
+
+    Installed packages imported by a job are pre-imported afterwards, so that
+    later jobs get them for free. If a pre-imported source file changes, the
+    server kills its running jobs, answers the next job with
+    ``{"id": id, "stale": true}`` and exits: the client is expected to start
+    a new server and resubmit the unfinished jobs.
+    """
+    get_coverage_class()
+    preload(modules)
+    stamps = module_stamps()
+    children = {}       # pid -> job
+    wakeup = child_wakeup()
+    stdin = sys.stdin.fileno()
+    pending = b''
+    reply({'ready': os.getpid()})
+    while True:
+        try:
+            readable = select.select([stdin, wakeup], [], [])[0]
+        except (select.error, OSError) as error:
+            # Interrupted by SIGCHLD (Python 2)
+            if error.args[0] != errno.EINTR:
+                raise
+            readable = [wakeup]
+        if wakeup in readable:
+            try:
+                os.read(wakeup, 4096)
+            except OSError:
+                pass
+            for pid, returncode in reap_children():
+                job = children.pop(pid, None)
+                if job is None:
+                    continue
+                # Learn the installed packages the job needed (before
+                # replying: the client deletes the results file once it has
+                # read it)
+                modules = read_modules(job['output'])
+                reply({'id': job['id'], 'returncode': returncode})
+                if any(name not in sys.modules for name in modules):
+                    preload(modules)
+                    stamps = module_stamps()
+        if stdin not in readable:
+            continue
+        data = os.read(stdin, 65536)
+        if not data:
+            break
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            job = json.loads(line.decode('ascii'))
+            if is_stale(stamps):
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                list(reap_children(block=True))
+                reply({'id': job['id'], 'stale': True})
+                return 0
+            pid = os.fork()
+            if pid == 0:
+                reset_child_wakeup(wakeup)
+                run_child(job)
+            children[pid] = job
+            reply({'id': job['id'], 'pid': pid})
+    # The client is gone: let the running jobs finish
+    list(reap_children(block=True))
+    return 0
+
+
+def read_modules(path):
+    """Return the third-party modules listed in the results file ``path``"""
+    try:
+        with open(path) as fobj:
+            return json.load(fobj).get('modules', [])
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def main(argv=None):
+    """Worker entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--server', action='store_true',
+                        help="run as a fork server (POSIX only)")
+    parser.add_argument('--preload', default='',
+                        help="comma-separated modules the server pre-imports")
+    parser.add_argument('--tests', action='store_true',
+                        help="filename and args are test modules or test "
+                             "ids to run with pytest or unittest")
+    parser.add_argument('--data-file',
+                        help="also save the coverage data to this file, "
+                             "with a parallel-mode suffix")
+    parser.add_argument('--combine', action='store_true',
+                        help="combine the data files of --data-file and "
+                             "write the results of filename to --output")
+    parser.add_argument('--include-file', action='append', default=[],
+                        help="--combine: also analyze this file, even if "
+                             "it was not measured")
+    parser.add_argument('-o', '--output',
+                        help="path of the JSON results file")
+    parser.add_argument('--save-data',
+                        help="also save the measured data to this file, "
+                             "replacing it")
+    parser.add_argument('--html',
+                        help="write the HTML report of the data of "
+                             "--data-file to this directory")
+    add_measure_options(parser)
+    parser.add_argument('filename', nargs='?', help="Python script to measure")
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help="arguments passed to the script")
+    options = parser.parse_args(argv)
+    settings = settings_from_args(options)
+
+    if options.server:
+        modules = [name.strip() for name in options.preload.split(',')]
+        return serve([name for name in modules if name])
+    if not options.filename:
+        parser.error("filename is required")
+    if options.html:
+        if not options.data_file:
+            parser.error("--html requires --data-file")
+        return html_report(options.data_file, options.filename, options.html,
+                           settings)
+    if options.combine:
+        if not options.data_file or not options.output:
+            parser.error("--combine requires --data-file and --output")
+        combine(options.data_file, options.filename, options.output,
+                options.include_file, settings, options.save_data)
+        return 0
+    if not options.output and not options.data_file:
+        parser.error("--output or --data-file is required")
+    measure(options.filename, options.args, options.output,
+            tests=options.tests, data_file=options.data_file,
+            settings=settings, save_to=options.save_data)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
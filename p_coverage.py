@@ -12,6 +12,10 @@
 # pylint: disable=R0911
 # pylint: disable=R0201
 
+import sys
+import weakref
+import multiprocessing
+
 from spyderlib.qt.QtGui import QInputDialog, QVBoxLayout, QGroupBox, QLabel
 from spyderlib.qt.QtCore import SIGNAL, Qt
 
@@ -20,8 +24,13 @@ from spyderlib.baseconfig import get_translation
 _ = get_translation("p_coverage", dirname="spyderplugins")
 from spyderlib.utils.qthelpers import get_icon, create_action
 from spyderlib.plugins import SpyderPluginMixin, PluginConfigPage
+from spyderlib.py3compat import to_text_string
 
-from spyderplugins.widgets.coveragegui import CoverageWidget, COVERAGE_PATH
+from spyderplugins.widgets.coverageworker import measure_settings
+from spyderplugins.widgets.coveragegui import (CoverageWidget, CoverageServer,
+                                               CoverageOverlay,
+                                               get_coverage_path,
+                                               register_dependency)
 
 
 class CoverageConfigPage(PluginConfigPage):
@@ -29,10 +38,153 @@ class CoverageConfigPage(PluginConfigPage):
         """
         Create the Spyder Config page for this plugin.
 
-        As of Dec 2014, there are no options available to set, so we only
-        display the data path.
+        Displays the data path, the worker and the measurement options.
         """
+        worker_group = QGroupBox(_("Worker"))
+        server_box = self.create_checkbox(
+            _("Keep a warm worker process between analyses"),
+            'worker_server', default=False,
+            tip=_("Coverage and the installed packages used by the analyzed "
+                  "code stay imported in a background process,\n"
+                  "which forks a clean copy of itself for each analysis "
+                  "(not available on Windows)"))
+        server_box.setEnabled(CoverageServer.is_supported())
+        preload_edit = self.create_lineedit(
+            _("Modules imported at worker startup (comma-separated):"),
+            'preload_modules', default='',
+            tip=_("For example: numpy, scipy, pandas"))
+        self.connect(server_box, SIGNAL("toggled(bool)"),
+                     preload_edit.setEnabled)
+        preload_edit.setEnabled(self.get_option('worker_server', False))
+
+        jobs_spin = self.create_spinbox(
+            _("Run up to "), _(" analyses at the same time"),
+            'max_jobs', default=2, min_=1, max_=64, step=1,
+            tip=_("Further analyses are queued"))
+
+        shard_spin = self.create_spinbox(
+            _("Test suites of packages run in "), _(" processes"),
+            'shard_count', default=multiprocessing.cpu_count(),
+            min_=1, max_=256, step=1,
+            tip=_("The test modules found under a package are split across "
+                  "this many processes"))
+
+        impact_box = self.create_checkbox(
+            _("Only re-run the tests impacted by changes"),
+            'test_impact', default=True,
+            tip=_("The lines run by each test of a package are recorded, "
+                  "so that after an edit only the tests\nthat ran the "
+                  "edited lines are run again. Edits to code run at import "
+                  "time trigger a full run."))
+
+        console_box = self.create_checkbox(
+            _("Run the analyses of files in the current console"),
+            'console_backend', default=False,
+            tip=_("The file is run in the namespace of the console, reusing "
+                  "the modules and data it already loaded,\ninstead of in "
+                  "a new process. Its output is shown in the console. "
+                  "Coverage must be installed\nin the interpreter of the "
+                  "console. Modules imported before the analysis are only "
+                  "measured\nfrom then on. Test suites of packages still "
+                  "run in separate processes."))
+
+        rerun_box = self.create_checkbox(
+            _("Re-run the analysis when a measured file is saved"),
+            'rerun_on_save', default=False,
+            tip=_("Saving changes replaces the running analysis. "
+                  "Successive saves made within half a second cause a "
+                  "single run."))
+
+        worker_layout = QVBoxLayout()
+        worker_layout.addWidget(server_box)
+        worker_layout.addWidget(preload_edit)
+        worker_layout.addWidget(console_box)
+        worker_layout.addWidget(jobs_spin)
+        worker_layout.addWidget(shard_spin)
+        worker_layout.addWidget(impact_box)
+        worker_layout.addWidget(rerun_box)
+        worker_group.setLayout(worker_layout)
+
+        measure_group = QGroupBox(_("Measurement"))
+        cores = [(_("Default"), ''),
+                 (_("C tracer"), 'ctrace'),
+                 (_("Python tracer (slowest)"), 'pytrace')]
+        if sys.version_info >= (3, 12):
+            cores.append((_("sys.monitoring (fastest)"), 'sysmon'))
+        core_combo = self.create_combobox(
+            _("Measurement core:"), cores, 'core', default='',
+            tip=_("Requires coverage 7.4 or later. sys.monitoring needs "
+                  "Python 3.12 or later, and 3.14 to measure branches\n"
+                  "(coverage falls back to the default core otherwise). "
+                  "Spyder's Python version decides which cores are listed."))
+        branch_box = self.create_checkbox(
+            _("Measure branch coverage"), 'branch', default=False,
+            tip=_("Slower, and disables the test impact analysis"))
+        subprocess_box = self.create_checkbox(
+            _("Measure the processes started by the analyzed code"),
+            'subprocess', default=False,
+            tip=_("Processes started with subprocess or multiprocessing are "
+                  "measured too, their data being combined\nat the end of "
+                  "the analysis. Pools left by a with block without pending "
+                  "tasks are joined;\nthe data of the workers of terminated "
+                  "pools is lost."))
+        project_box = self.create_checkbox(
+            _("Only measure the project of the analyzed file"),
+            'project_scope', default=True,
+            tip=_("The project is the Spyder project of the file, or else "
+                  "the nearest directory holding a setup.py,\n"
+                  "pyproject.toml or version control directory. Its "
+                  "scope can be narrowed with the filter button."))
+        source_edit = self.create_lineedit(
+            _("Only measure these packages or directories "
+              "(comma-separated):"), 'source', default='',
+            tip=_("Overrides the project scope"))
+        include_edit = self.create_lineedit(
+            _("Only measure the files matching these patterns "
+              "(comma-separated):"), 'include', default='',
+            tip=_("Ignored if packages or directories are given above"))
+        omit_edit = self.create_lineedit(
+            _("Do not measure the files matching these patterns "
+              "(comma-separated):"), 'omit', default='',
+            tip=_("For example: */tests/*, */migrations/*"))
+
+        measure_layout = QVBoxLayout()
+        measure_layout.addWidget(core_combo)
+        measure_layout.addWidget(branch_box)
+        measure_layout.addWidget(subprocess_box)
+        measure_layout.addWidget(project_box)
+        measure_layout.addWidget(source_edit)
+        measure_layout.addWidget(include_edit)
+        measure_layout.addWidget(omit_edit)
+        measure_group.setLayout(measure_layout)
+
         results_group = QGroupBox(_("Results"))
+        cache_box = self.create_checkbox(
+            _("Reuse results when no measured source file changed"),
+            'use_cache', default=True,
+            tip=_("Applies to the keyboard shortcut: the Analyze button "
+                  "always runs a new analysis"))
+        html_box = self.create_checkbox(
+            _("Update an HTML report after each analysis"),
+            'html_report', default=False,
+            tip=_("The report is updated in the background, only the pages "
+                  "of the files whose coverage or source\nchanged being "
+                  "rewritten. Runs of the tests impacted by changes do not "
+                  "update it."))
+        keep_box = self.create_checkbox(
+            _("Keep the coverage data of the analyses"),
+            'keep_data', default=True,
+            tip=_("Each analysis saves its data to its own file, from which "
+                  "the HTML report can be generated\nlater without "
+                  "measuring again"))
+        keep_size_spin = self.create_spinbox(
+            _("Keep up to "), _(" MB of data"), 'data_cache_size',
+            default=200, min_=1, max_=100000, step=10,
+            tip=_("The oldest data is removed first, except the data of the "
+                  "latest analysis of each file"))
+        keep_age_spin = self.create_spinbox(
+            _("Remove the data older than "), _(" days"), 'data_cache_age',
+            default=7, min_=1, max_=3650, step=1)
         results_label1 = QLabel(_("Results are stored here:"))
         results_label1.setWordWrap(True)
 
@@ -45,11 +197,18 @@ class CoverageConfigPage(PluginConfigPage):
         results_label2.setWordWrap(True)
 
         results_layout = QVBoxLayout()
+        results_layout.addWidget(cache_box)
+        results_layout.addWidget(html_box)
+        results_layout.addWidget(keep_box)
+        results_layout.addWidget(keep_size_spin)
+        results_layout.addWidget(keep_age_spin)
         results_layout.addWidget(results_label1)
         results_layout.addWidget(results_label2)
         results_group.setLayout(results_layout)
 
         vlayout = QVBoxLayout()
+        vlayout.addWidget(worker_group)
+        vlayout.addWidget(measure_group)
         vlayout.addWidget(results_group)
         vlayout.addStretch(1)
         self.setLayout(vlayout)
@@ -64,6 +223,7 @@ class Coverage(CoverageWidget, SpyderPluginMixin):
         CoverageWidget.__init__(self, parent=parent,
                                 max_entries=self.get_option('max_entries', 50))
         SpyderPluginMixin.__init__(self, parent)
+        self.apply_plugin_settings(None)
 
         # Initialize plugin
         self.initialize_plugin()
@@ -107,10 +267,24 @@ class Coverage(CoverageWidget, SpyderPluginMixin):
                      self.main.redirect_internalshell_stdio)
         self.main.add_dockwidget(self)
 
+        self.overlay = CoverageOverlay(self)
+        self.connect(self, SIGNAL("results_shown(PyQt_PyObject)"),
+                     self.overlay.set_results)
+        # The editor stacks of split panes and new editor windows are only
+        # known once the Editor plugin relays their signals
+        self.editorstacks = weakref.WeakSet()
+        self.connect(self.main.editor, SIGNAL("update_plugin_title()"),
+                     self.connect_editorstacks)
+        self.connect_editorstacks()
+        self.attach_current_editor()
+        self.overlay.set_results(self.get_data(
+                                    to_text_string(self.filecombo.currentText())))
+        register_dependency(probe=False)
+
         coverage_act = create_action(self,
                                      _("Run code_coverage analysis"),
                                      triggered=self.run_coverage)
-        coverage_act.setEnabled(COVERAGE_PATH is not None)
+        coverage_act.setEnabled(get_coverage_path() is not None)
         self.register_shortcut(coverage_act, context="coverage",
                                name="run analysis",
                                default="Alt+F11")
@@ -124,15 +298,83 @@ class Coverage(CoverageWidget, SpyderPluginMixin):
 
     def closing_plugin(self, cancelable=False):
         """Perform actions before parent main window is closed"""
+        self.kill_if_running(all_jobs=True)
+        self.set_worker_server(False)
         return True
 
     def apply_plugin_settings(self, options):
         """Apply configuration file's plugin settings"""
         # The history depth option will be applied at
         # next Spyder startup, which is soon enough
-        pass
+        self.use_cache = self.get_option('use_cache', True)
+        self.shard_count = self.get_option('shard_count',
+                                           multiprocessing.cpu_count())
+        self.test_impact = self.get_option('test_impact', True)
+        self.max_jobs = self.get_option('max_jobs', 2)
+        self.console_execute = None
+        if self.get_option('console_backend', False):
+            self.console_execute = self.execute_in_console
+        self.measure_settings = measure_settings(
+            self.get_option('core', ''), self.get_option('branch', False),
+            self.get_option('source', ''), self.get_option('include', ''),
+            self.get_option('omit', ''), self.get_option('subprocess', False))
+        self.project_scope = self.get_option('project_scope', True)
+        self.html_report = self.get_option('html_report', False)
+        self.keep_data = self.get_option('keep_data', True)
+        self.data_cache.max_size = \
+            self.get_option('data_cache_size', 200) * 2 ** 20
+        self.data_cache.max_age = \
+            self.get_option('data_cache_age', 7) * 86400
+        self.schedule()
+        self.set_rerun_on_save(self.get_option('rerun_on_save', False))
+        self.set_worker_server(self.get_option('worker_server', False),
+                               self.get_option('preload_modules', ''))
 
     #------ Public API --------------------------------------------------------
+    def get_project_root(self, filename):
+        """Reimplement get_project_root: prefer the Spyder project"""
+        explorer = getattr(self.main, 'projectexplorer', None)
+        if explorer is not None:
+            project = explorer.get_source_project(filename)
+            if project is not None:
+                return project.root_path
+        return CoverageWidget.get_project_root(self, filename)
+
+    def execute_in_console(self, line):
+        """
+        Execute ``line`` in the console Spyder runs files in, and return
+        True, or False if there is no console
+        """
+        main = self.main
+        if main.ipyconsole is None \
+           or main.last_console_plugin_focus_was_python:
+            return main.extconsole.execute_python_code(line)
+        if main.ipyconsole.get_current_client() is None:
+            return False
+        main.ipyconsole.execute_python_code(line)
+        return True
+
+    def attach_current_editor(self):
+        """Show the coverage markers in the gutter of the current editor"""
+        editor = self.main.editor
+        self.overlay.attach(editor.get_current_editor(),
+                            editor.get_current_filename())
+
+    def connect_editorstacks(self):
+        """
+        Show the coverage markers in the editors whose file becomes the
+        current one of their editor stack
+        """
+        for editorstack in self.main.editor.editorstacks:
+            if editorstack in self.editorstacks:
+                continue
+            self.editorstacks.add(editorstack)
+            self.connect(editorstack,
+                         SIGNAL('current_file_changed(QString,int)'),
+                         lambda filename, _position, stack=editorstack:
+                         self.overlay.attach(stack.get_current_editor(),
+                                             filename))
+
     # TODO: Get rid of this superfluous code
     def change_history_depth(self):
         "Change history max entries"""
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Tests of the test impact analysis
+
+Run with ``python -m unittest spyderplugins.widgets.test_coverageimpact``.
+"""
+
+import os
+import os.path as osp
+import shutil
+import tempfile
+import unittest
+
+from spyderplugins.widgets.coverageworker import fingerprint, line_hashes
+from spyderplugins.widgets.coverageimpact import (build_index, select_tests,
+                                                  merge)
+
+CODE = """\
+import math
+def square(x):
+    return x * x
+def root(x):
+    return math.sqrt(x)
+"""
+
+
+class ImpactTest(unittest.TestCase):
+    """Selection of the impacted tests and merge of their results"""
+
+    def setUp(self):
+        self.directory = osp.realpath(tempfile.mkdtemp())
+        self.code = osp.join(self.directory, 'code.py')
+        self.tests = osp.join(self.directory, 'test_code.py')
+        self.write(self.code, CODE)
+        self.write(self.tests, "from code import square, root\n")
+        self.test_square = self.tests + '::test_square'
+        self.test_root = self.tests + '::test_root'
+        # Module-level lines are run outside of any test
+        contexts = {'': {self.code: [1, 2, 4]},
+                    self.test_square: {self.code: [3]},
+                    self.test_root: {self.code: [5]}}
+        self.index = self.build(contexts)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, text):
+        """Write ``text`` to ``filename``, changing its fingerprint"""
+        with open(filename, 'w') as fobj:
+            fobj.write(text)
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 1))
+
+    def results(self, contexts):
+        """Return the results of a run executing ``contexts``"""
+        statements = [1, 2, 3, 4, 5]
+        executed = sorted(set(line for files in contexts.values()
+                              for line in files.get(self.code, [])))
+        return {'files': {self.code: {
+                    'statements': statements, 'executed': executed,
+                    'missing': sorted(set(statements) - set(executed)),
+                    'excluded': []}},
+                'sources': dict((filename, fingerprint(filename))
+                                for filename in (self.code, self.tests)),
+                'hashes': {self.code: line_hashes(self.code)},
+                'contexts': contexts}
+
+    def build(self, contexts):
+        """Return the index of a run executing ``contexts``"""
+        return build_index(self.results(contexts), [self.tests])
+
+    def test_no_index_with_branches(self):
+        """Runs measuring branches have no index"""
+        results = dict(self.results({}), branch=True)
+        self.assertIsNone(build_index(results, [self.tests]))
+        self.assertIsNone(select_tests(None, [self.tests]))
+
+    def test_unchanged(self):
+        """No test is selected when nothing changed"""
+        selection = select_tests(self.index, [self.tests])
+        self.assertEqual(selection.names, [])
+        self.assertEqual(selection.dropped, set())
+
+    def test_changed_line(self):
+        """Only the tests running a changed line are selected"""
+        self.write(self.code, CODE.replace('math.sqrt(x)', 'x ** 0.5'))
+        selection = select_tests(self.index, [self.tests])
+        self.assertEqual(selection.names, [self.test_root])
+        self.assertEqual(selection.dropped, set([self.test_root]))
+        self.assertEqual(selection.changed_files(), [self.code])
+
+    def test_changed_module_level(self):
+        """Changes to lines run outside of any test need a full run"""
+        self.write(self.code, CODE.replace('import math', 'import cmath'))
+        self.assertIsNone(select_tests(self.index, [self.tests]))
+
+    def test_changed_test_module(self):
+        """A changed test module is run again"""
+        self.write(self.tests, "from code import square\n")
+        selection = select_tests(self.index, [self.tests])
+        self.assertEqual(selection.names, [self.tests])
+        self.assertEqual(selection.dropped,
+                         set([self.test_square, self.test_root]))
+
+    def test_merge(self):
+        """The results of the selected tests replace their former data"""
+        # test_root no longer runs line 5: its new line is a new statement
+        self.write(self.code, CODE.replace('    return math.sqrt(x)',
+                                           '    if x < 0:\n'
+                                           '        return 0.0'))
+        selection = select_tests(self.index, [self.tests])
+        self.assertEqual(selection.names, [self.test_root])
+        results = self.results({self.test_root: {self.code: [5]}})
+        results['files'][self.code]['statements'] = [1, 2, 3, 4, 5, 6]
+        merged, index = merge(self.index, selection, results, [self.tests])
+        fdata = merged['files'][self.code]
+        # Lines 1 to 4 kept from the index, 5 from the new run
+        self.assertEqual(fdata['executed'], [1, 2, 3, 4, 5])
+        self.assertEqual(fdata['missing'], [6])
+        self.assertEqual(index['contexts'][self.test_square],
+                         {self.code: [3]})
+        self.assertEqual(index['contexts'][self.test_root],
+                         {self.code: [5]})
+        # Nothing changed since the merged run
+        self.assertEqual(select_tests(index, [self.tests]).names, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Tests of the coverage results store
+
+Run with ``python -m unittest spyderplugins.widgets.test_coveragestore``.
+"""
+
+import unittest
+
+from spyderplugins.widgets.coveragestore import (pack_lines, unpack_lines,
+                                                 count_lines)
+
+
+class PackLinesTest(unittest.TestCase):
+    """Run-length encoding of line numbers"""
+
+    def check(self, lines):
+        """Check that ``lines`` are decoded as encoded"""
+        data = pack_lines(lines)
+        self.assertEqual(unpack_lines(data), lines)
+        self.assertEqual(count_lines(data), len(lines))
+        return data
+
+    def test_empty(self):
+        """No lines"""
+        self.assertEqual(self.check([]), b'')
+
+    def test_runs(self):
+        """Consecutive lines are stored as (start, length) runs"""
+        data = self.check([1, 2, 3, 7])
+        self.assertEqual(data, pack_lines([1, 2, 3]) + pack_lines([7]))
+        self.assertEqual(len(data), len(pack_lines([1, 7])))
+
+    def test_single_lines(self):
+        """Lines without neighbours"""
+        self.check([2, 4, 6, 100000])
+
+    def test_long_run(self):
+        """A whole file of executed lines takes a single run"""
+        lines = list(range(1, 5001))
+        self.assertEqual(len(self.check(lines)), len(pack_lines([1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
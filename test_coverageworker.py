@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the terms of the MIT License
+# (see spyderlib/__init__.py for details)
+
+"""
+Tests of the coverage worker
+
+Run with ``python -m unittest test_coverageworker`` from this directory: the
+worker is run as a script, in the current interpreter, which must have
+coverage installed.
+"""
+
+import sys
+import os.path as osp
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+WORKER_PATH = osp.join(osp.dirname(osp.abspath(__file__)),
+                       'coverageworker.py')
+
+HELPER = """\
+def square(x):
+    return x * x
+"""
+
+POOL_SCRIPT = """\
+import multiprocessing
+from helper import square
+
+if __name__ == '__main__':
+    with multiprocessing.Pool(2) as pool:
+        print(pool.map(square, range(20)))
+"""
+
+
+def has_coverage():
+    """Return True if coverage is installed"""
+    try:
+        import coverage  # analysis:ignore
+    except ImportError:
+        return False
+    return True
+
+
+@unittest.skipUnless(has_coverage(), "coverage is not installed")
+@unittest.skipIf(sys.version_info < (3, 3), "pools are context managers")
+class SubprocessTest(unittest.TestCase):
+    """Measurement of the processes started by the measured code"""
+
+    def setUp(self):
+        self.directory = osp.realpath(tempfile.mkdtemp())
+        for name, text in (('helper.py', HELPER), ('main.py', POOL_SCRIPT)):
+            with open(osp.join(self.directory, name), 'w') as fobj:
+                fobj.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_with_pool_workers_covered(self):
+        """Workers of a pool left by a with block are covered"""
+        output = osp.join(self.directory, 'results.json')
+        # Several runs: the workers used to be killed at random points
+        for _run in range(3):
+            subprocess.check_call(
+                [sys.executable, WORKER_PATH, '--subprocess',
+                 '--output', output, 'main.py'],
+                cwd=self.directory, stdout=subprocess.PIPE)
+            with open(output) as fobj:
+                files = json.load(fobj)['files']
+            helper = files[osp.join(self.directory, 'helper.py')]
+            self.assertEqual(helper['missing'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()